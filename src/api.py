@@ -4,22 +4,48 @@ Provides HTTP endpoints for business insights that can be consumed by assistants
 """
 import os
 import sys
-from datetime import datetime, timedelta
-from fastapi import FastAPI, UploadFile, File
+import asyncio
+import calendar
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import FastAPI, UploadFile, File, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+import numpy as np
 import pandas as pd
+import orjson
 import uvicorn
-import requests
-import shutil
+import httpx
+import gzip
+import threading
+import uuid
+import hashlib
 
 # Add the src directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from data_loader import load_data
+from data_loader import load_data, days_since, shift_month, top_k, monthly_sums_by_key, rfm_segment_rules, rank_quintiles, save_data_file, CATEGORICAL_COLS
+
+# Shared HTTP client (connection pooling across webhook calls)
+_http_client = httpx.AsyncClient(timeout=60)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm the reminders snapshot so the first request is served from memory
+    try:
+        await asyncio.to_thread(get_reminders_snapshot)
+    except Exception:
+        pass  # No data yet; the snapshot is built on first request or upload
+    yield
+    await _http_client.aclose()
+
 
 app = FastAPI(
     title="Dashboard Ventas API",
     description="API para recordatorios e insights de negocio",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Enable CORS for all origins
@@ -35,29 +61,71 @@ app.add_middleware(
 # Path relative to src/ directory
 DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "source.csv")
 
+# Buffer size for streaming uploaded CSVs to disk
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
 # N8N Webhook Configuration (production URL - workflow must be active)
 N8N_WEBHOOK_URL = "https://em-n8n.yny2jy.easypanel.host/webhook/1ab642e1-0cfc-48ca-a5b9-4f8ccfefca2c"
 
-# Global cache for API data (separate from Streamlit cache)
-_api_df_cache = None
-_api_df_cache_path = None
+# Outcome of background pushes to n8n, by job id (in-memory, per worker)
+_PUSH_JOBS = {}
+MAX_PUSH_JOBS = 100
+
+# Serialized /api/reminders response for the current CSV version
+_SNAPSHOT = {"key": None, "bytes": b"", "etag": ""}
+_SNAPSHOT_LOCK = threading.Lock()
+
+# Global cache for API data (separate from Streamlit cache).
+# Keyed by the CSV's (mtime, size) so repeat requests skip parsing entirely.
+_DF_CACHE = {"key": None, "df": None}
+_DF_LOCK = threading.Lock()
+
+def get_df_version():
+    """
+    (CSV version key, dataframe), read together under the lock so caches derived from the
+    frame are stored under the version it actually came from.
+    """
+    with _DF_LOCK:
+        stat = os.stat(DATA_PATH)
+        key = (stat.st_mtime_ns, stat.st_size)
+        
+        # If cache is empty or file changed, reload
+        if _DF_CACHE["key"] != key:
+            _DF_CACHE["df"] = _prepare_api_df(_load_source_df())
+            _DF_CACHE["key"] = key
+        
+        return _DF_CACHE["key"], _DF_CACHE["df"]
 
 def get_df():
-    """Load and return the dataframe. Uses a simple cache that can be cleared."""
-    global _api_df_cache, _api_df_cache_path
-    
-    # If cache is empty or file changed, reload
-    if _api_df_cache is None or _api_df_cache_path != DATA_PATH:
-        _api_df_cache = load_data(DATA_PATH)
-        _api_df_cache_path = DATA_PATH
-    
-    return _api_df_cache
+    """Load and return the dataframe, re-parsing only when the CSV changes on disk."""
+    return get_df_version()[1]
+
+def _load_source_df():
+    """Processed dataframe for the current CSV (load_data reads its Parquet sidecar when it is up to date)."""
+    return load_data(DATA_PATH)
+
+def refresh_parquet_cache():
+    """Parse a freshly uploaded CSV now, so load_data rewrites the Parquet sidecar before the next request."""
+    return _load_source_df()
+
+def _prepare_api_df(df):
+    """One-time dtype tuning: categorical group keys (integer-code groupbys) and ns-resolution dates."""
+    # load_data already casts the keys (then a no-op); kept so the API never groups on plain columns
+    for col in CATEGORICAL_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    if 'fecha' in df.columns:
+        df['fecha'] = df['fecha'].astype('datetime64[ns]')
+        # Month/year from load_data so per-request filters are narrow int compares
+        df['_month'] = df['num_mes']
+        df['_year'] = df['num_anio']
+    return df
 
 def clear_api_cache():
     """Clear the API data cache to force reload on next request."""
-    global _api_df_cache, _api_df_cache_path
-    _api_df_cache = None
-    _api_df_cache_path = None
+    with _DF_LOCK:
+        _DF_CACHE["key"] = None
+        _DF_CACHE["df"] = None
 
 
 @app.get("/")
@@ -76,13 +144,18 @@ async def upload_data(file: UploadFile = File(...)):
         # Determine strict path
         save_path = DATA_PATH
         
-        # Save the uploaded file
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save the uploaded file (large buffer, atomic swap, off the event loop)
+        await asyncio.to_thread(save_data_file, file.file, save_path, UPLOAD_CHUNK_SIZE)
+        
+        # Persist the parsed/normalized data so the next load (or worker boot) reads Parquet
+        await asyncio.to_thread(refresh_parquet_cache)
         
         # Clear the API cache to force reload
         clear_api_cache()
         
+        # Rebuild the reminders snapshot now instead of on the next request
+        await asyncio.to_thread(get_reminders_snapshot)
+        
         # Also try to clear Streamlit cache if available
         try:
             import streamlit as st
@@ -111,44 +184,29 @@ def get_rfm_segments():
     today = df['fecha'].max()
     
     # Calculate RFM metrics per customer
-    rfm = df.groupby('cliente_nombre').agg({
+    rfm = df.groupby('cliente_nombre', observed=True).agg({
         'fecha': 'max',           # Last purchase date (Recency)
         'factura_id': 'nunique',  # Number of transactions (Frequency)
         'venta_neta': 'sum'       # Total revenue (Monetary)
     }).reset_index()
     
     rfm.columns = ['cliente', 'ultima_compra', 'frecuencia', 'valor_monetario']
-    rfm['recencia'] = (today - rfm['ultima_compra']).dt.days
+    rfm['recencia'] = days_since(today, rfm['ultima_compra'])
     
     # Assign scores 1-5 using quintiles (5 = best)
     rfm['R_score'] = pd.qcut(rfm['recencia'], 5, labels=[5, 4, 3, 2, 1], duplicates='drop').astype(int)
-    rfm['F_score'] = pd.qcut(rfm['frecuencia'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5], duplicates='drop').astype(int)
-    rfm['M_score'] = pd.qcut(rfm['valor_monetario'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5], duplicates='drop').astype(int)
+    rfm['F_score'] = rank_quintiles(rfm['frecuencia'])
+    rfm['M_score'] = rank_quintiles(rfm['valor_monetario'])
     
     rfm['RFM_score'] = rfm['R_score'].astype(str) + rfm['F_score'].astype(str) + rfm['M_score'].astype(str)
     rfm['RFM_total'] = rfm['R_score'] + rfm['F_score'] + rfm['M_score']
     
-    # Assign segments
-    def assign_segment(row):
-        r, f, m = row['R_score'], row['F_score'], row['M_score']
-        if r >= 4 and f >= 4 and m >= 4:
-            return 'VIP'
-        elif r >= 4 and f >= 4:
-            return 'Leal'
-        elif r >= 4 and m >= 4:
-            return 'Potencial'
-        elif r <= 2 and f >= 3 and m >= 3:
-            return 'En Riesgo'
-        elif r <= 2 and m >= 3:
-            return 'Dormidos'
-        elif r <= 2:
-            return 'Perdidos'
-        elif r >= 4 and f <= 2:
-            return 'Nuevos'
-        else:
-            return 'Regular'
-    
-    rfm['segmento'] = rfm.apply(assign_segment, axis=1)
+    # Assign segments (first matching rule wins)
+    rfm['segmento'] = np.select(
+        rfm_segment_rules(rfm['R_score'], rfm['F_score'], rfm['M_score']),
+        ['VIP', 'Leal', 'Potencial', 'En Riesgo', 'Dormidos', 'Perdidos', 'Nuevos'],
+        default='Regular'
+    )
     
     # Build response
     segment_summary = rfm.groupby('segmento').agg({
@@ -163,402 +221,258 @@ def get_rfm_segments():
     segments_detail = {}
     for seg in rfm['segmento'].unique():
         seg_df = rfm[rfm['segmento'] == seg].nlargest(10, 'valor_monetario')
-        segments_detail[seg] = [
-            {
-                'cliente': row['cliente'],
-                'recencia': int(row['recencia']),
-                'frecuencia': int(row['frecuencia']),
-                'valor_monetario': round(row['valor_monetario'], 2),
-                'rfm_score': row['RFM_score']
-            }
-            for _, row in seg_df.iterrows()
-        ]
+        seg_df = seg_df[['cliente', 'recencia', 'frecuencia', 'valor_monetario', 'RFM_score']]
+        seg_df = seg_df.astype({'recencia': int, 'frecuencia': int}).round({'valor_monetario': 2})
+        segments_detail[seg] = seg_df.rename(columns={'RFM_score': 'rfm_score'}).to_dict('records')
     
     return {
         "fecha_generacion": datetime.now().isoformat(),
         "total_clientes": len(rfm),
-        "resumen_segmentos": [
-            {
-                "segmento": row['segmento'],
-                "cantidad_clientes": int(row['cantidad_clientes']),
-                "valor_total": round(row['valor_total'], 2),
-                "frecuencia_promedio": round(row['frecuencia_promedio'], 1),
-                "recencia_promedio": round(row['recencia_promedio'], 0)
-            }
-            for _, row in segment_summary.iterrows()
-        ],
+        "resumen_segmentos": segment_summary.astype({'cantidad_clientes': int}).round(
+            {'valor_total': 2, 'frecuencia_promedio': 1, 'recencia_promedio': 0}
+        ).to_dict('records'),
         "detalle_segmentos": segments_detail
     }
 
 @app.post("/api/push-to-n8n")
-def push_to_n8n():
-
-    """Push comprehensive reminders to n8n webhook."""
-    df = get_df()
-    today = df['fecha'].max()
-    current_month = today.month
-    current_year = today.year
-    
-    # --- TOP 40 CLIENTES (ordenados por días sin comprar ASC, primero los de 90+ días) ---
-    cust_stats = df.groupby('cliente_nombre').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count'],
-        'cantidad': 'sum'
-    }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones', 'cantidad']
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
-    
-    # Filtrar clientes importantes (>5 transacciones O >5000 en ventas)
-    clientes_importantes = cust_stats[(cust_stats['transacciones'] > 5) | (cust_stats['total_ventas'] > 5000)]
-    
-    # Ordenar por días ascendente (90, 91, 92...)
-    clientes_inactivos = clientes_importantes[clientes_importantes['dias_sin_compra'] >= 90].sort_values('dias_sin_compra', ascending=True).head(40)
-    
-    clientes_list = []
-    for _, row in clientes_inactivos.iterrows():
-        clientes_list.append({
-            'cliente': row['cliente'],
-            'dias_sin_compra': int(row['dias_sin_compra']),
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'ultima_compra': row['ultima_compra'].strftime('%Y-%m-%d')
-        })
-    
-    # --- TOP 40 PRODUCTOS (ordenados por días sin vender ASC) ---
-    prod_stats = df.groupby('producto').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count'],
-        'cantidad': 'sum'
-    }).reset_index()
-    prod_stats.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones', 'cantidad']
-    prod_stats['dias_sin_venta'] = (today - prod_stats['ultima_venta']).dt.days
-    
-    # Filtrar productos importantes (>10 transacciones O >5000 en ventas)
-    productos_importantes = prod_stats[(prod_stats['transacciones'] > 10) | (prod_stats['total_ventas'] > 5000)]
-    
-    # Ordenar por días ascendente
-    productos_sin_venta = productos_importantes[productos_importantes['dias_sin_venta'] >= 60].sort_values('dias_sin_venta', ascending=True).head(40)
-    
-    productos_list = []
-    for _, row in productos_sin_venta.iterrows():
-        productos_list.append({
-            'producto': row['producto'],
-            'dias_sin_venta': int(row['dias_sin_venta']),
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'ultima_venta': row['ultima_venta'].strftime('%Y-%m-%d')
-        })
-    
-    # --- CLIENTES QUE ACABAN DE COMPRAR (últimos 7 días, top ventas) ---
-    clientes_recientes = clientes_importantes[clientes_importantes['dias_sin_compra'] <= 7].sort_values('total_ventas', ascending=False).head(15)
-    recientes_clientes = []
-    for _, row in clientes_recientes.iterrows():
-        recientes_clientes.append({
-            'cliente': row['cliente'],
-            'dias_sin_compra': int(row['dias_sin_compra']),
-            'total_ventas': round(row['total_ventas'], 2)
-        })
-    
-    # --- PRODUCTOS QUE ACABAN DE SALIR (últimos 7 días, top ventas) ---
-    productos_recientes = productos_importantes[productos_importantes['dias_sin_venta'] <= 7].sort_values('total_ventas', ascending=False).head(15)
-    recientes_productos = []
-    for _, row in productos_recientes.iterrows():
-        recientes_productos.append({
-            'producto': row['producto'],
-            'dias_sin_venta': int(row['dias_sin_venta']),
-            'total_ventas': round(row['total_ventas'], 2)
-        })
-    
-    # --- TOP CLIENTES SIN IMPORTAR FECHA (los que más compran en total) ---
-    top_clientes_siempre = clientes_importantes.nlargest(20, 'total_ventas')
-    top_clientes_list = []
-    for _, row in top_clientes_siempre.iterrows():
-        top_clientes_list.append({
-            'cliente': row['cliente'],
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'dias_sin_compra': int(row['dias_sin_compra'])
-        })
-    
-    # --- TOP PRODUCTOS SIN IMPORTAR FECHA ---
-    top_productos_siempre = productos_importantes.nlargest(20, 'total_ventas')
-    top_productos_list = []
-    for _, row in top_productos_siempre.iterrows():
-        top_productos_list.append({
-            'producto': row['producto'],
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'dias_sin_venta': int(row['dias_sin_venta'])
-        })
-    
-    # --- VENTAS MENSUALES - COMPARACIÓN 3 MESES ---
-    def get_month_num(current, offset):
-        m = current - offset
-        if m <= 0:
-            m += 12
-        return m
-    
-    mes_actual = current_month
-    mes_anterior = get_month_num(current_month, 1)
-    mes_anterior_2 = get_month_num(current_month, 2)
-    
-    df_mes_actual = df[df['fecha'].dt.month == mes_actual]
-    df_mes_ant1 = df[df['fecha'].dt.month == mes_anterior]
-    df_mes_ant2 = df[df['fecha'].dt.month == mes_anterior_2]
-    
-    # --- COMPARACIÓN DE CLIENTES (3 MESES) ---
-    clientes_m0 = df_mes_actual.groupby('cliente_nombre')['venta_neta'].sum().nlargest(20).reset_index()
-    clientes_m0.columns = ['cliente', 'mes_actual']
-    clientes_m1 = df_mes_ant1.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    clientes_m1.columns = ['cliente', 'mes_anterior']
-    clientes_m2 = df_mes_ant2.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    clientes_m2.columns = ['cliente', 'hace_2_meses']
-    
-    comp_clientes = clientes_m0.merge(clientes_m1, on='cliente', how='left').merge(clientes_m2, on='cliente', how='left').fillna(0)
-    comp_clientes['cambio_vs_anterior'] = comp_clientes['mes_actual'] - comp_clientes['mes_anterior']
-    comp_clientes['cambio_vs_hace_2'] = comp_clientes['mes_actual'] - comp_clientes['hace_2_meses']
-    comparacion_clientes_list = comp_clientes.round(2).to_dict('records')
+async def push_to_n8n(background_tasks: BackgroundTasks):
+    """
+    Push comprehensive reminders to n8n webhook.
+    The POST to n8n runs in the background; poll /api/push-to-n8n/status/{job_id} for the outcome.
+    """
+    # Pandas work runs in a worker thread so the event loop stays free
+    payload = await asyncio.to_thread(get_reminders_payload)
+    result = {"fecha_generacion": datetime.now().isoformat(), **payload}
     
-    # --- COMPARACIÓN DE PRODUCTOS (3 MESES) ---
-    prods_m0 = df_mes_actual.groupby('producto')['venta_neta'].sum().nlargest(20).reset_index()
-    prods_m0.columns = ['producto', 'mes_actual']
-    prods_m1 = df_mes_ant1.groupby('producto')['venta_neta'].sum().reset_index()
-    prods_m1.columns = ['producto', 'mes_anterior']
-    prods_m2 = df_mes_ant2.groupby('producto')['venta_neta'].sum().reset_index()
-    prods_m2.columns = ['producto', 'hace_2_meses']
-    
-    comp_productos = prods_m0.merge(prods_m1, on='producto', how='left').merge(prods_m2, on='producto', how='left').fillna(0)
-    comp_productos['cambio_vs_anterior'] = comp_productos['mes_actual'] - comp_productos['mes_anterior']
-    comp_productos['cambio_vs_hace_2'] = comp_productos['mes_actual'] - comp_productos['hace_2_meses']
-    comparacion_productos_list = comp_productos.round(2).to_dict('records')
+    job_id = uuid.uuid4().hex
+    _PUSH_JOBS[job_id] = {"status": "pendiente", "creado": result["fecha_generacion"]}
+    while len(_PUSH_JOBS) > MAX_PUSH_JOBS:
+        _PUSH_JOBS.pop(next(iter(_PUSH_JOBS)))  # Drop the oldest job
+    background_tasks.add_task(_post_to_n8n, job_id, result)
     
-    # --- RESULTADO COMPLETO ---
-    result = {
-        "fecha_generacion": datetime.now().isoformat(),
-        "periodo_datos": {
-            "desde": df['fecha'].min().strftime('%Y-%m-%d'),
-            "hasta": df['fecha'].max().strftime('%Y-%m-%d')
-        },
-        "meta_ventas_mes": get_monthly_comparison_data(df, today),
-        
-        "clientes_inactivos_40": {
-            "descripcion": "Top 40 clientes importantes sin comprar >=90 días, ordenados por días (asc)",
-            "total": len(clientes_list),
-            "lista": clientes_list
-        },
-        
-        "productos_sin_movimiento_40": {
-            "descripcion": "Top 40 productos importantes sin vender >=60 días, ordenados por días (asc)",
-            "total": len(productos_list),
-            "lista": productos_list
-        },
-        
-        "clientes_recientes": {
-            "descripcion": "Clientes que compraron en los últimos 7 días (top por ventas totales)",
-            "lista": recientes_clientes
-        },
-        
-        "productos_recientes": {
-            "descripcion": "Productos vendidos en los últimos 7 días (top por ventas totales)",
-            "lista": recientes_productos
-        },
-        
-        "top_clientes_historico": {
-            "descripcion": "Top 20 clientes por ventas totales (sin importar fecha)",
-            "lista": top_clientes_list
-        },
-        
-        "top_productos_historico": {
-            "descripcion": "Top 20 productos por ventas totales (sin importar fecha)",
-            "lista": top_productos_list
-        },
-        
-        "comparacion_mensual_clientes": {
-            "descripcion": "Top 20 clientes - comparación 3 meses (mes actual, anterior, hace 2 meses)",
-            "meses": {"actual": mes_actual, "anterior": mes_anterior, "hace_2": mes_anterior_2},
-            "lista": comparacion_clientes_list
-        },
-        
-        "comparacion_mensual_productos": {
-            "descripcion": "Top 20 productos - comparación 3 meses (mes actual, anterior, hace 2 meses)",
-            "meses": {"actual": mes_actual, "anterior": mes_anterior, "hace_2": mes_anterior_2},
-            "lista": comparacion_productos_list
-        },
-        
-        "resumen_ejecutivo": generate_executive_summary(df, today)
+    return {
+        "success": True,
+        "queued": True,
+        "message": "Envío a n8n en proceso",
+        "job_id": job_id,
+        "status_url": f"/api/push-to-n8n/status/{job_id}",
+        "data_preview": {
+            "clientes_inactivos": len(result["clientes_inactivos_40"]["lista"]),
+            "productos_sin_movimiento": len(result["productos_sin_movimiento_40"]["lista"]),
+            "clientes_recientes": len(result["clientes_recientes"]["lista"]),
+            "productos_recientes": len(result["productos_recientes"]["lista"])
+        }
     }
-    
+
+
+@app.get("/api/push-to-n8n/status/{job_id}")
+def get_push_status(job_id: str):
+    """Get the outcome of a queued push-to-n8n job."""
+    job = _PUSH_JOBS.get(job_id)
+    if job is None:
+        return {"success": False, "error": f"Job {job_id} no encontrado"}
+    return {"job_id": job_id, **job}
+
+
+async def _post_to_n8n(job_id, result):
+    """Background task: POST the payload to n8n and record the outcome under job_id."""
+    job = _PUSH_JOBS.get(job_id, {})
     try:
-        # Use POST with JSON body
-        response = requests.post(N8N_WEBHOOK_URL, json=result, timeout=60, headers={"Content-Type": "application/json"})
-        return {
+        # Encode once with orjson instead of letting httpx re-encode with stdlib json
+        body = orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        # Gzip the body (level 3: most of the size win for a fraction of the CPU)
+        response = await _http_client.post(
+            N8N_WEBHOOK_URL,
+            content=gzip.compress(body, compresslevel=3),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        )
+        job.update({
+            "status": "enviado",
             "success": True,
             "message": "Datos enviados a n8n exitosamente",
             "n8n_status_code": response.status_code,
-            "n8n_response": response.text[:500] if response.text else None,
-            "data_preview": {
-                "clientes_inactivos": len(clientes_list),
-                "productos_sin_movimiento": len(productos_list),
-                "clientes_recientes": len(recientes_clientes),
-                "productos_recientes": len(recientes_productos)
-            }
-        }
+            "n8n_response": response.text[:500] if response.text else None
+        })
     except Exception as e:
-        return {
-            "success": False,
-            "error": str(e)
-        }
+        job.update({"status": "error", "success": False, "error": str(e)})
 
 
 @app.get("/api/reminders")
-def get_all_reminders():
-    """Get all business reminders - SAME DATA as push-to-n8n webhook."""
-    df = get_df()
-    today = df['fecha'].max()
+async def get_all_reminders(request: Request):
+    """
+    Get all business reminders - SAME DATA as push-to-n8n webhook.
+    Served from the pre-serialized snapshot; honors If-None-Match with 304.
+    """
+    snapshot = await asyncio.to_thread(get_reminders_snapshot)
+    headers = {"ETag": snapshot["etag"]}
+    if request.headers.get("if-none-match") == snapshot["etag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot["bytes"], media_type="application/json", headers=headers)
+
+
+@app.get("/api/reminders/meta-ventas")
+def get_monthly_target():
+    """Get sales comparison with previous years for current month."""
+    return get_reminder_sections()["meta"]
+
+
+@app.get("/api/reminders/clientes-inactivos")
+def get_inactive_customers():
+    """Get list of customers who haven't purchased in >90 days."""
+    return get_reminder_sections()["inactive"]
+
+
+@app.get("/api/reminders/productos-sin-movimiento")
+def get_stale_products():
+    """Get top-selling products that haven't sold recently."""
+    return get_reminder_sections()["stale"]
+
+
+# --- Helper Functions ---
+
+def get_reminders_snapshot():
+    """
+    Return the reminders JSON bytes and ETag, re-serialized only when the CSV version changes.
+    fecha_generacion is the time the snapshot was built.
+    """
+    # Key and frame from one locked read, so a concurrent upload can't pair an old body with a new ETag key
+    key, df = get_df_version()
+    with _SNAPSHOT_LOCK:
+        if _SNAPSHOT["key"] != key:
+            result = {"fecha_generacion": datetime.now().isoformat(), **_cached_reminders_payload(key, df)}
+            body = orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+            _SNAPSHOT["bytes"] = body
+            _SNAPSHOT["etag"] = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+            _SNAPSHOT["key"] = key
+        return dict(_SNAPSHOT)
+
+
+def get_reminders_payload():
+    """Return the reminders payload for the current dataframe (memoized per CSV version)."""
+    return _cached_reminders_payload(*get_df_version())
+
+
+def _per_version(memo, lock, key, build):
+    """build()'s result for CSV version `key`, computed once; `memo` only keeps the latest version."""
+    with lock:
+        if memo["key"] != key:
+            memo["value"] = build()
+            memo["key"] = key
+        return memo["value"]
+
+
+# Reminders payload / sections for the CSV version in "key" (callers must not mutate them)
+_PAYLOAD = {"key": None, "value": None}
+_PAYLOAD_LOCK = threading.Lock()
+_SECTIONS = {"key": None, "value": None}
+_SECTIONS_LOCK = threading.Lock()
+
+
+def _cached_reminders_payload(df_key, df):
+    """Payload for `df`, memoized under its version key (the pair from get_df_version)."""
+    return _per_version(_PAYLOAD, _PAYLOAD_LOCK, df_key, lambda: _build_reminders_payload(
+        df, df['fecha'].max(), _cached_reminder_sections(df_key, df)))
+
+
+def get_reminder_sections():
+    """Return the meta / inactive / stale sections for the current dataframe (memoized per CSV version)."""
+    return _cached_reminder_sections(*get_df_version())
+
+
+def _cached_reminder_sections(df_key, df):
+    """Compute the three sub-reports once per version; shared by their endpoints, the payload and the summary."""
+    return _per_version(_SECTIONS, _SECTIONS_LOCK, df_key, lambda: _reminder_sections(df, df['fecha'].max()))
+
+
+def _reminder_sections(df, today):
+    """The meta / inactive / stale sub-reports of `df`."""
+    return {
+        "meta": get_monthly_comparison_data(df, today),
+        "inactive": get_inactive_customers_data(df, today),
+        "stale": get_stale_products_data(df, today)
+    }
+
+
+def _build_reminders_payload(df, today, sections):
+    """Build the full reminders payload shared by /api/reminders and /api/push-to-n8n."""
     current_month = today.month
     current_year = today.year
     
     # --- TOP 40 CLIENTES (ordenados por días sin comprar ASC, primero los de 90+ días) ---
-    cust_stats = df.groupby('cliente_nombre').agg({
+    # Filtrar clientes importantes (>5 transacciones O >5000 en ventas) antes del agg completo
+    df_clientes = _important_rows(df, 'cliente_nombre', min_transacciones=5)
+    clientes_importantes = df_clientes.groupby('cliente_nombre', observed=True).agg({
         'venta_neta': 'sum',
         'fecha': ['max', 'count'],
         'cantidad': 'sum'
     }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones', 'cantidad']
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
-    
-    # Filtrar clientes importantes (>5 transacciones O >5000 en ventas)
-    clientes_importantes = cust_stats[(cust_stats['transacciones'] > 5) | (cust_stats['total_ventas'] > 5000)]
+    clientes_importantes.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones', 'cantidad']
+    clientes_importantes['dias_sin_compra'] = days_since(today, clientes_importantes['ultima_compra'])
+    clientes_importantes = _cast_stats(clientes_importantes)
     
     # Ordenar por días ascendente (90, 91, 92...)
-    clientes_inactivos = clientes_importantes[clientes_importantes['dias_sin_compra'] >= 90].sort_values('dias_sin_compra', ascending=True).head(40)
-    
-    clientes_list = []
-    for _, row in clientes_inactivos.iterrows():
-        clientes_list.append({
-            'cliente': row['cliente'],
-            'dias_sin_compra': int(row['dias_sin_compra']),
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'ultima_compra': row['ultima_compra'].strftime('%Y-%m-%d')
-        })
+    clientes_inactivos = clientes_importantes.iloc[_top_k_inactive(clientes_importantes['dias_sin_compra'].values, 90, 40)]
+    
+    clientes_list = _to_records(
+        clientes_inactivos, ['cliente', 'dias_sin_compra', 'total_ventas', 'transacciones', 'ultima_compra']
+    )
     
     # --- TOP 40 PRODUCTOS (ordenados por días sin vender ASC) ---
-    prod_stats = df.groupby('producto').agg({
+    # Filtrar productos importantes (>10 transacciones O >5000 en ventas) antes del agg completo
+    df_productos = _important_rows(df, 'producto', min_transacciones=10)
+    productos_importantes = df_productos.groupby('producto', observed=True).agg({
         'venta_neta': 'sum',
         'fecha': ['max', 'count'],
         'cantidad': 'sum'
     }).reset_index()
-    prod_stats.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones', 'cantidad']
-    prod_stats['dias_sin_venta'] = (today - prod_stats['ultima_venta']).dt.days
-    
-    # Filtrar productos importantes (>10 transacciones O >5000 en ventas)
-    productos_importantes = prod_stats[(prod_stats['transacciones'] > 10) | (prod_stats['total_ventas'] > 5000)]
+    productos_importantes.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones', 'cantidad']
+    productos_importantes['dias_sin_venta'] = days_since(today, productos_importantes['ultima_venta'])
+    productos_importantes = _cast_stats(productos_importantes)
     
     # Ordenar por días ascendente
-    productos_sin_venta = productos_importantes[productos_importantes['dias_sin_venta'] >= 60].sort_values('dias_sin_venta', ascending=True).head(40)
-    
-    productos_list = []
-    for _, row in productos_sin_venta.iterrows():
-        productos_list.append({
-            'producto': row['producto'],
-            'dias_sin_venta': int(row['dias_sin_venta']),
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'ultima_venta': row['ultima_venta'].strftime('%Y-%m-%d')
-        })
+    productos_sin_venta = productos_importantes.iloc[_top_k_inactive(productos_importantes['dias_sin_venta'].values, 60, 40)]
+    
+    productos_list = _to_records(
+        productos_sin_venta, ['producto', 'dias_sin_venta', 'total_ventas', 'transacciones', 'ultima_venta']
+    )
     
     # --- CLIENTES QUE ACABAN DE COMPRAR (últimos 7 días, top ventas) ---
-    clientes_recientes = clientes_importantes[clientes_importantes['dias_sin_compra'] <= 7].sort_values('total_ventas', ascending=False).head(15)
-    recientes_clientes = []
-    for _, row in clientes_recientes.iterrows():
-        recientes_clientes.append({
-            'cliente': row['cliente'],
-            'dias_sin_compra': int(row['dias_sin_compra']),
-            'total_ventas': round(row['total_ventas'], 2)
-        })
+    clientes_recientes = clientes_importantes.iloc[top_k(
+        clientes_importantes['total_ventas'].values, 15, mask=clientes_importantes['dias_sin_compra'].values <= 7
+    )]
+    recientes_clientes = _to_records(clientes_recientes, ['cliente', 'dias_sin_compra', 'total_ventas'])
     
     # --- PRODUCTOS QUE ACABAN DE SALIR (últimos 7 días, top ventas) ---
-    productos_recientes = productos_importantes[productos_importantes['dias_sin_venta'] <= 7].sort_values('total_ventas', ascending=False).head(15)
-    recientes_productos = []
-    for _, row in productos_recientes.iterrows():
-        recientes_productos.append({
-            'producto': row['producto'],
-            'dias_sin_venta': int(row['dias_sin_venta']),
-            'total_ventas': round(row['total_ventas'], 2)
-        })
+    productos_recientes = productos_importantes.iloc[top_k(
+        productos_importantes['total_ventas'].values, 15, mask=productos_importantes['dias_sin_venta'].values <= 7
+    )]
+    recientes_productos = _to_records(productos_recientes, ['producto', 'dias_sin_venta', 'total_ventas'])
     
     # --- TOP CLIENTES SIN IMPORTAR FECHA (los que más compran en total) ---
-    top_clientes_siempre = clientes_importantes.nlargest(20, 'total_ventas')
-    top_clientes_list = []
-    for _, row in top_clientes_siempre.iterrows():
-        top_clientes_list.append({
-            'cliente': row['cliente'],
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'dias_sin_compra': int(row['dias_sin_compra'])
-        })
+    top_clientes_siempre = clientes_importantes.iloc[top_k(clientes_importantes['total_ventas'].values, 20)]
+    top_clientes_list = _to_records(top_clientes_siempre, ['cliente', 'total_ventas', 'transacciones', 'dias_sin_compra'])
     
     # --- TOP PRODUCTOS SIN IMPORTAR FECHA ---
-    top_productos_siempre = productos_importantes.nlargest(20, 'total_ventas')
-    top_productos_list = []
-    for _, row in top_productos_siempre.iterrows():
-        top_productos_list.append({
-            'producto': row['producto'],
-            'total_ventas': round(row['total_ventas'], 2),
-            'transacciones': int(row['transacciones']),
-            'dias_sin_venta': int(row['dias_sin_venta'])
-        })
+    top_productos_siempre = productos_importantes.iloc[top_k(productos_importantes['total_ventas'].values, 20)]
+    top_productos_list = _to_records(top_productos_siempre, ['producto', 'total_ventas', 'transacciones', 'dias_sin_venta'])
     
     # --- VENTAS MENSUALES - COMPARACIÓN 3 MESES ---
-    def get_month_num(current, offset):
-        m = current - offset
-        if m <= 0:
-            m += 12
-        return m
-    
-    mes_actual = current_month
-    mes_anterior = get_month_num(current_month, 1)
-    mes_anterior_2 = get_month_num(current_month, 2)
-    
-    df_mes_actual = df[df['fecha'].dt.month == mes_actual]
-    df_mes_ant1 = df[df['fecha'].dt.month == mes_anterior]
-    df_mes_ant2 = df[df['fecha'].dt.month == mes_anterior_2]
+    meses = [shift_month(current_month, k) for k in range(3)]
+    mes_actual, mes_anterior, mes_anterior_2 = meses
     
     # --- COMPARACIÓN DE CLIENTES (3 MESES) ---
-    clientes_m0 = df_mes_actual.groupby('cliente_nombre')['venta_neta'].sum().nlargest(20).reset_index()
-    clientes_m0.columns = ['cliente', 'mes_actual']
-    clientes_m1 = df_mes_ant1.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    clientes_m1.columns = ['cliente', 'mes_anterior']
-    clientes_m2 = df_mes_ant2.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    clientes_m2.columns = ['cliente', 'hace_2_meses']
-    
-    comp_clientes = clientes_m0.merge(clientes_m1, on='cliente', how='left').merge(clientes_m2, on='cliente', how='left').fillna(0)
-    comp_clientes['cambio_vs_anterior'] = comp_clientes['mes_actual'] - comp_clientes['mes_anterior']
-    comp_clientes['cambio_vs_hace_2'] = comp_clientes['mes_actual'] - comp_clientes['hace_2_meses']
-    comparacion_clientes_list = comp_clientes.round(2).to_dict('records')
+    comparacion_clientes_list = _monthly_comparison(df, 'cliente_nombre', 'cliente', meses).to_dict('records')
     
     # --- COMPARACIÓN DE PRODUCTOS (3 MESES) ---
-    prods_m0 = df_mes_actual.groupby('producto')['venta_neta'].sum().nlargest(20).reset_index()
-    prods_m0.columns = ['producto', 'mes_actual']
-    prods_m1 = df_mes_ant1.groupby('producto')['venta_neta'].sum().reset_index()
-    prods_m1.columns = ['producto', 'mes_anterior']
-    prods_m2 = df_mes_ant2.groupby('producto')['venta_neta'].sum().reset_index()
-    prods_m2.columns = ['producto', 'hace_2_meses']
-    
-    comp_productos = prods_m0.merge(prods_m1, on='producto', how='left').merge(prods_m2, on='producto', how='left').fillna(0)
-    comp_productos['cambio_vs_anterior'] = comp_productos['mes_actual'] - comp_productos['mes_anterior']
-    comp_productos['cambio_vs_hace_2'] = comp_productos['mes_actual'] - comp_productos['hace_2_meses']
-    comparacion_productos_list = comp_productos.round(2).to_dict('records')
-    
-    # --- RESULTADO COMPLETO (MISMO QUE WEBHOOK) ---
-    result = {
-        "fecha_generacion": datetime.now().isoformat(),
+    comparacion_productos_list = _monthly_comparison(df, 'producto', 'producto', meses).to_dict('records')
+    
+    # --- RESULTADO COMPLETO ---
+    return {
         "periodo_datos": {
             "desde": df['fecha'].min().strftime('%Y-%m-%d'),
             "hasta": df['fecha'].max().strftime('%Y-%m-%d')
         },
-        "meta_ventas_mes": get_monthly_comparison_data(df, today),
+        "meta_ventas_mes": sections["meta"],
         
         "clientes_inactivos_40": {
             "descripcion": "Top 40 clientes importantes sin comprar >=90 días, ordenados por días (asc)",
@@ -604,37 +518,53 @@ def get_all_reminders():
             "lista": comparacion_productos_list
         },
         
-        "resumen_ejecutivo": generate_executive_summary(df, today)
+        "resumen_ejecutivo": generate_executive_summary(sections["meta"], sections["inactive"], sections["stale"])
     }
-    
-    return result
 
 
-@app.get("/api/reminders/meta-ventas")
-def get_monthly_target():
-    """Get sales comparison with previous years for current month."""
-    df = get_df()
-    today = df['fecha'].max()
-    return get_monthly_comparison_data(df, today)
+def _important_rows(df, key, min_transacciones, min_ventas=5000):
+    """Rows whose key has more than `min_transacciones` sales or more than `min_ventas` in revenue."""
+    stats = df.groupby(key, sort=False, observed=True).agg(n=('fecha', 'count'), ventas=('venta_neta', 'sum'))
+    important = stats.index[(stats['n'] > min_transacciones) | (stats['ventas'] > min_ventas)]
+    return df[df[key].isin(important)]
 
 
-@app.get("/api/reminders/clientes-inactivos")
-def get_inactive_customers():
-    """Get list of customers who haven't purchased in >90 days."""
-    df = get_df()
-    today = df['fecha'].max()
-    return get_inactive_customers_data(df, today)
+def _top_k_inactive(dias, days_thr, k):
+    """Positions of the k rows with dias >= days_thr, fewest days first (ties keep row order)."""
+    return top_k(dias, k, ascending=True, mask=dias >= days_thr)
 
 
-@app.get("/api/reminders/productos-sin-movimiento")
-def get_stale_products():
-    """Get top-selling products that haven't sold recently."""
-    df = get_df()
-    today = df['fecha'].max()
-    return get_stale_products_data(df, today)
+def _cast_stats(stats):
+    """Frame-level output casts, done once: int32 counts/days and 2-decimal sales."""
+    int_cols = [c for c in stats.columns if c.startswith(('dias_', 'transacciones'))]
+    stats = stats.astype(dict.fromkeys(int_cols, 'int32'))
+    stats['total_ventas'] = stats['total_ventas'].round(2)
+    return stats
 
 
-# --- Helper Functions ---
+def _to_records(frame, columns):
+    """Export already-cast stats rows, with dates as ISO strings."""
+    out = frame[columns].copy()
+    for col in out.columns:
+        if col.startswith('ultima_'):
+            out[col] = out[col].dt.strftime('%Y-%m-%d')
+    return out.to_dict('records')
+
+
+def _monthly_comparison(df, key, label, meses, top_n=20):
+    """Top-N sales per key for the current month vs the two previous months (single bincount pass)."""
+    mes_actual = meses[0]
+    monthly = monthly_sums_by_key(df, key, '_month', meses)
+    
+    # Only keys that sold in the current month compete for the top N
+    actual = monthly[mes_actual].values
+    comp = monthly.iloc[top_k(actual, top_n, mask=~np.isnan(actual))].fillna(0)
+    comp.columns = ['mes_actual', 'mes_anterior', 'hace_2_meses']
+    comp = comp.rename_axis(label).reset_index()
+    comp['cambio_vs_anterior'] = comp['mes_actual'] - comp['mes_anterior']
+    comp['cambio_vs_hace_2'] = comp['mes_actual'] - comp['hace_2_meses']
+    return comp.round(2)
+
 
 def get_monthly_comparison_data(df, today):
     """Calculate sales comparison with previous years for current month."""
@@ -642,14 +572,12 @@ def get_monthly_comparison_data(df, today):
     current_year = today.year
     
     # Sales by year for current month
-    df_month = df[df['fecha'].dt.month == current_month].copy()
-    yearly_sales = df_month.groupby(df_month['fecha'].dt.year).agg({
-        'venta_neta': 'sum',
-        'factura_id': 'nunique',
-        'cantidad': 'sum'
-    }).reset_index()
-    yearly_sales.columns = ['año', 'ventas', 'transacciones', 'cantidad']
-    yearly_sales = yearly_sales.sort_values('año', ascending=False)
+    df_month = df.loc[df['_month'] == current_month, ['_year', 'venta_neta', 'factura_id', 'cantidad']]
+    yearly_sales = df_month.groupby('_year').agg(
+        ventas=('venta_neta', 'sum'),
+        transacciones=('factura_id', 'nunique'),
+        cantidad=('cantidad', 'sum')
+    ).sort_index(ascending=False).rename_axis('año').reset_index()
     
     # Calculate averages and targets
     historical = yearly_sales[yearly_sales['año'] < current_year]
@@ -660,7 +588,7 @@ def get_monthly_comparison_data(df, today):
     current_sales = current['ventas'].sum() if not current.empty else 0
     
     # Days elapsed in month vs total days
-    days_in_month = (today.replace(month=today.month % 12 + 1, day=1) - timedelta(days=1)).day if today.month < 12 else 31
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
     days_elapsed = today.day
     projected_sales = (current_sales / days_elapsed * days_in_month) if days_elapsed > 0 else 0
     
@@ -683,26 +611,24 @@ def get_monthly_comparison_data(df, today):
 def get_inactive_customers_data(df, today, days_threshold=90):
     """Get customers who haven't purchased in X days."""
     # Get customer stats
-    cust_stats = df.groupby('cliente_nombre').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count'],
-        'cantidad': 'sum'
-    }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones', 'cantidad']
+    cust_stats = df.groupby('cliente_nombre', observed=True, sort=False).agg(
+        total_ventas=('venta_neta', 'sum'),
+        ultima_compra=('fecha', 'max'),
+        transacciones=('fecha', 'count'),
+        cantidad=('cantidad', 'sum')
+    ).rename_axis('cliente').reset_index()
     
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
+    cust_stats['dias_sin_compra'] = days_since(today, cust_stats['ultima_compra'])
     
     # Filter relevant clients (with significant history)
     relevant = cust_stats[(cust_stats['transacciones'] > 3) | (cust_stats['total_ventas'] > 5000)]
-    inactive = relevant[relevant['dias_sin_compra'] > days_threshold].sort_values('total_ventas', ascending=False)
+    inactive = relevant[relevant['dias_sin_compra'] > days_threshold]
     
     # Calculate potential lost revenue
     potential_lost = inactive['total_ventas'].sum()
     
-    inactive_list = inactive.head(20).to_dict('records')
-    for item in inactive_list:
-        item['ultima_compra'] = item['ultima_compra'].strftime('%Y-%m-%d')
-        item['total_ventas'] = round(item['total_ventas'], 2)
+    top_inactive = _cast_stats(inactive.iloc[top_k(inactive['total_ventas'].values, 20)])
+    inactive_list = _to_records(top_inactive, list(top_inactive.columns))
     
     return {
         "umbral_dias": days_threshold,
@@ -715,25 +641,22 @@ def get_inactive_customers_data(df, today, days_threshold=90):
 def get_stale_products_data(df, today, days_threshold=60):
     """Get top-selling products that haven't sold recently."""
     # Get product stats
-    prod_stats = df.groupby('producto').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count'],
-        'cantidad': 'sum'
-    }).reset_index()
-    prod_stats.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones', 'cantidad']
+    prod_stats = df.groupby('producto', observed=True, sort=False).agg(
+        total_ventas=('venta_neta', 'sum'),
+        ultima_venta=('fecha', 'max'),
+        transacciones=('fecha', 'count'),
+        cantidad=('cantidad', 'sum')
+    ).reset_index()
     
-    prod_stats['dias_sin_venta'] = (today - prod_stats['ultima_venta']).dt.days
+    prod_stats['dias_sin_venta'] = days_since(today, prod_stats['ultima_venta'])
     
     # Top products by historical sales
-    top_products = prod_stats.nlargest(50, 'total_ventas')
+    top_products = prod_stats.iloc[top_k(prod_stats['total_ventas'].values, 50)]
     
-    # Filter those that haven't sold recently
-    stale = top_products[top_products['dias_sin_venta'] > days_threshold].sort_values('total_ventas', ascending=False)
+    # Filter those that haven't sold recently (already ordered by sales)
+    stale = top_products[top_products['dias_sin_venta'] > days_threshold]
     
-    stale_list = stale.to_dict('records')
-    for item in stale_list:
-        item['ultima_venta'] = item['ultima_venta'].strftime('%Y-%m-%d')
-        item['total_ventas'] = round(item['total_ventas'], 2)
+    stale_list = _to_records(_cast_stats(stale), list(stale.columns))
     
     return {
         "umbral_dias": days_threshold,
@@ -742,12 +665,8 @@ def get_stale_products_data(df, today, days_threshold=60):
     }
 
 
-def generate_executive_summary(df, today):
-    """Generate an executive summary text for the assistant."""
-    meta = get_monthly_comparison_data(df, today)
-    inactive = get_inactive_customers_data(df, today)
-    stale = get_stale_products_data(df, today)
-    
+def generate_executive_summary(meta, inactive, stale):
+    """Generate an executive summary text for the assistant from the precomputed sections."""
     summary_parts = []
     
     # Sales target status
@@ -1,9 +1,18 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from data_loader import load_data, get_kpis, normalize_products
+import numpy as np
+import pyarrow as pa
+from data_loader import load_data, data_version, save_data_file, get_kpis, normalize_products, shift_month, months_before, format_year_month, days_since, days_between, top_k, monthly_sums_by_key, rfm_segment_rules, rank_quintiles, contains_mask, category_summary
 import io
+import calendar
+import hashlib
+import hmac
+import importlib.util
+import os
+
+# xlsxwriter is faster than openpyxl; only probe for it here, pandas imports the engine on the first export
+EXCEL_ENGINE = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
 
 # --- HELPER FUNCTIONS FOR UI ENHANCEMENTS ---
 
@@ -26,24 +35,37 @@ def styled_metric(label, value, delta=None, delta_color="normal"):
         if delta_color == "inverse":  # For metrics where lower is better
             color = "#ef553b" if delta > 0 else "#00cc96"
         
-        st.markdown(f"""
+        st.html(f"""
         <div style="background: linear-gradient(135deg, #1e1e2e 0%, #2d2d44 100%); 
                     padding: 1rem; border-radius: 10px; border-left: 4px solid {color};">
             <p style="margin: 0; color: #888; font-size: 0.85rem;">{label}</p>
             <p style="margin: 0; font-size: 1.5rem; font-weight: bold; color: white;">{value}</p>
             <p style="margin: 0; color: {color}; font-size: 0.9rem;">{arrow} {delta_text}</p>
         </div>
-        """, unsafe_allow_html=True)
+        """)
     else:
         st.metric(label, value)
 
 
+@st.cache_data(show_spinner=False, max_entries=16)
+def export_bytes(df):
+    """
+    CSV and .xlsx bytes of a table, cached on its content so reruns don't re-serialize it.
+    Bounded: every filter/segment selection is a different table.
+    """
+    csv = df.to_csv(index=False).encode('utf-8')
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine=EXCEL_ENGINE) as writer:
+        df.to_excel(writer, index=False, sheet_name='Datos')
+    return csv, buffer.getvalue()
+
+
 def export_dataframe(df, filename, key):
     """Add export buttons for CSV and Excel."""
     col1, col2 = st.columns([1, 1])
+    csv, excel_data = export_bytes(df)
     
     # CSV export
-    csv = df.to_csv(index=False).encode('utf-8')
     col1.download_button(
         label="📥 Exportar CSV",
         data=csv,
@@ -53,10 +75,6 @@ def export_dataframe(df, filename, key):
     )
     
     # Excel export
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Datos')
-    excel_data = buffer.getvalue()
     col2.download_button(
         label="📥 Exportar Excel",
         data=excel_data,
@@ -90,6 +108,15 @@ def show_confidence_interval(prediction, std_dev, confidence=0.95):
     upper = prediction + z * std_dev
     return lower, upper
 
+
+def plot_frame(data, columns):
+    """
+    Only the plotted columns, with int64 counts narrowed to int32 (plotly ships numeric columns as
+    typed arrays). Amounts stay float64: float32 can't hold cents at these totals and hovers show them.
+    """
+    out = data[list(columns)]
+    return out.astype({c: np.int32 for c in out.columns if out[c].dtype == np.int64})
+
 # Page Configuration
 st.set_page_config(
     page_title="Dashboard de Ventas",
@@ -99,126 +126,186 @@ st.set_page_config(
 )
 
 # --- PASSWORD PROTECTION ---
-DASHBOARD_PIN = "101010"
+DASHBOARD_PIN_ITERATIONS = 200_000
 MAX_ATTEMPTS = 5
-LOCKOUT_MINUTES = 5
+LOCKOUT_MINUTES = 5  # first lockout; doubles with each further one
+MAX_LOCKOUT_DOUBLINGS = 5
+AUTH_COOKIE = "auth_token"
+
+
+def dashboard_setting(name):
+    """Deployment setting from the environment, else from .streamlit/secrets.toml; None when unset."""
+    value = os.environ.get(name)
+    if value:
+        return value
+    try:
+        return st.secrets.get(name) or None
+    except FileNotFoundError:
+        return None
+
+
+# Salted PBKDF2-SHA256 of the access PIN, from the deployment config (hex strings), never from source:
+# a published hash can be brute-forced over the short PIN space. The iteration count keeps that slow.
+try:
+    DASHBOARD_PIN_SALT = bytes.fromhex(dashboard_setting("DASHBOARD_PIN_SALT") or "")
+    PIN_CONFIG_ERROR = None
+except ValueError:
+    # Not hex: refuse logins below instead of crashing the script at import
+    DASHBOARD_PIN_SALT = b""
+    PIN_CONFIG_ERROR = "DASHBOARD_PIN_SALT no es un valor hexadecimal válido."
+DASHBOARD_PIN_HASH = (dashboard_setting("DASHBOARD_PIN_HASH") or "").strip().lower()
+
+# Server-side key for the "remember me" cookie. Not in source: anyone reading the repo could
+# otherwise mint today's token. Without it the cookie is disabled and the PIN is asked every time.
+AUTH_COOKIE_SECRET = dashboard_setting("DASHBOARD_COOKIE_SECRET")
+
+try:
+    from streamlit_cookies_manager import CookieManager
+    COOKIES_AVAILABLE = True
+except ImportError:
+    COOKIES_AVAILABLE = False
+
+
+def auth_token(day=None):
+    """Day-scoped login token: HMAC of the date keyed on AUTH_COOKIE_SECRET, so it expires at midnight."""
+    from datetime import date
+    day = (day or date.today()).isoformat()
+    return hmac.new(AUTH_COOKIE_SECRET.encode(), day.encode(), hashlib.sha256).hexdigest()
+
+
+def hash_pin(pin):
+    """PBKDF2 hash of a PIN with the dashboard salt, comparable to DASHBOARD_PIN_HASH."""
+    return hashlib.pbkdf2_hmac("sha256", pin.encode(), DASHBOARD_PIN_SALT, DASHBOARD_PIN_ITERATIONS).hex()
+
+
+# Login / lockout screen styles; %s is the title color
+LOGIN_CSS = """
+<style>
+.login-container {
+    display: flex;
+    flex-direction: column;
+    align-items: center;
+    justify-content: center;
+    height: 60vh;
+}
+.login-title {
+    font-size: 2.5rem;
+    margin-bottom: 1rem;
+    color: %s;
+}
+</style>
+"""
+
+
+def login_header(title, color="#00d4aa"):
+    """Styles, container and title shared by the login and lockout screens."""
+    st.html(LOGIN_CSS % color + f"<div class='login-container'><p class='login-title'>{title}</p></div>")
+
+
+def password_entered():
+    """Checks whether the password is correct."""
+    from datetime import datetime, timedelta
+    entered = st.session_state.get("password") or ""
+    if hmac.compare_digest(hash_pin(entered), DASHBOARD_PIN_HASH):
+        st.session_state["password_correct"] = True
+        st.session_state["failed_attempts"] = 0  # Reset on success
+        st.session_state["lockouts"] = 0
+        st.session_state["issue_auth_cookie"] = True
+        del st.session_state["password"]
+    else:
+        st.session_state["password_correct"] = False
+        st.session_state["failed_attempts"] += 1
+        # Lock out after MAX_ATTEMPTS, doubling the wait on each repeated lockout
+        if st.session_state["failed_attempts"] >= MAX_ATTEMPTS:
+            minutes = LOCKOUT_MINUTES * 2 ** min(st.session_state["lockouts"], MAX_LOCKOUT_DOUBLINGS)
+            st.session_state["lockout_until"] = datetime.now() + timedelta(minutes=minutes)
+            st.session_state["lockouts"] += 1
+        if "password" in st.session_state:
+            del st.session_state["password"]
+
+
+@st.fragment
+def login_form():
+    """PIN form. A wrong PIN only reruns this fragment; success or a lockout reruns the whole app."""
+    if st.session_state.get("password_correct") or st.session_state["lockout_until"]:
+        st.rerun()
+    login_header("🔐 Dashboard de Ventas")
+    st.text_input(
+        "Ingresa el PIN de acceso:",
+        type="password",
+        on_change=password_entered,
+        key="password",
+        placeholder="••••••"
+    )
+    if st.session_state.get("password_correct") is False:
+        attempts_left = MAX_ATTEMPTS - st.session_state["failed_attempts"]
+        if attempts_left > 0:
+            st.error(f"❌ PIN incorrecto. Te quedan {attempts_left} intento(s).")
+
 
 def check_password():
     """Returns True if the user has entered the correct password."""
-    from datetime import datetime, timedelta
+    from datetime import datetime
+    
+    if PIN_CONFIG_ERROR or not (DASHBOARD_PIN_SALT and DASHBOARD_PIN_HASH):
+        login_header("🔒 Acceso no configurado", "#ef553b")
+        st.error(f"⛔ {PIN_CONFIG_ERROR or 'Falta configurar DASHBOARD_PIN_SALT y DASHBOARD_PIN_HASH en el servidor.'}")
+        return False
+    
+    cookies = None
+    if COOKIES_AVAILABLE and AUTH_COOKIE_SECRET:
+        cookies = CookieManager(prefix="dashboard-ventas/")
+        if not cookies.ready():
+            # The component reports the browser cookies on the next run
+            return False
     
     # Initialize attempt counter and lockout time if not exists
     if "failed_attempts" not in st.session_state:
         st.session_state["failed_attempts"] = 0
     if "lockout_until" not in st.session_state:
         st.session_state["lockout_until"] = None
+    if "lockouts" not in st.session_state:
+        st.session_state["lockouts"] = 0
     
     # Check if currently locked out
     if st.session_state["lockout_until"]:
         if datetime.now() < st.session_state["lockout_until"]:
             remaining = (st.session_state["lockout_until"] - datetime.now()).seconds // 60 + 1
-            st.markdown("""
-            <style>
-            .login-container {
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-                justify-content: center;
-                height: 60vh;
-            }
-            .login-title {
-                font-size: 2.5rem;
-                margin-bottom: 1rem;
-                color: #ef553b;
-            }
-            </style>
-            """, unsafe_allow_html=True)
-            
-            st.markdown("<div class='login-container'>", unsafe_allow_html=True)
-            st.markdown("<p class='login-title'>🔒 Acceso Bloqueado</p>", unsafe_allow_html=True)
+            login_header("🔒 Acceso Bloqueado", "#ef553b")
             st.error(f"⛔ Demasiados intentos fallidos. Espera {remaining} minuto(s) para intentar de nuevo.")
-            st.markdown("</div>", unsafe_allow_html=True)
             return False
         else:
-            # Lockout expired, reset
+            # Lockout expired: new attempts, but the lockout count is kept so the next one lasts longer
             st.session_state["failed_attempts"] = 0
             st.session_state["lockout_until"] = None
     
-    def password_entered():
-        """Checks whether the password is correct."""
-        if st.session_state.get("password") == DASHBOARD_PIN:
+    # A valid cookie from an earlier login today skips the form on browser refresh (never during a lockout)
+    if cookies is not None and not st.session_state.get("password_correct"):
+        if hmac.compare_digest(cookies.get(AUTH_COOKIE, ""), auth_token()):
             st.session_state["password_correct"] = True
-            st.session_state["failed_attempts"] = 0  # Reset on success
-            del st.session_state["password"]
-        else:
-            st.session_state["password_correct"] = False
-            st.session_state["failed_attempts"] += 1
-            # Lock out after MAX_ATTEMPTS
-            if st.session_state["failed_attempts"] >= MAX_ATTEMPTS:
-                st.session_state["lockout_until"] = datetime.now() + timedelta(minutes=LOCKOUT_MINUTES)
-            if "password" in st.session_state:
-                del st.session_state["password"]
-    
-    # Login form styles
-    login_styles = """
-    <style>
-    .login-container {
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        justify-content: center;
-        height: 60vh;
-    }
-    .login-title {
-        font-size: 2.5rem;
-        margin-bottom: 1rem;
-        color: #00d4aa;
-    }
-    </style>
-    """
     
-    # First run or not authenticated
-    if "password_correct" not in st.session_state:
-        st.markdown(login_styles, unsafe_allow_html=True)
-        st.markdown("<div class='login-container'>", unsafe_allow_html=True)
-        st.markdown("<p class='login-title'>🔐 Dashboard de Ventas</p>", unsafe_allow_html=True)
-        st.text_input(
-            "Ingresa el PIN de acceso:",
-            type="password",
-            on_change=password_entered,
-            key="password",
-            placeholder="••••••"
-        )
-        st.markdown("</div>", unsafe_allow_html=True)
-        return False
-    
-    # Wrong password entered
-    elif not st.session_state["password_correct"]:
-        st.markdown(login_styles, unsafe_allow_html=True)
-        st.markdown("<div class='login-container'>", unsafe_allow_html=True)
-        st.markdown("<p class='login-title'>🔐 Dashboard de Ventas</p>", unsafe_allow_html=True)
-        st.text_input(
-            "Ingresa el PIN de acceso:",
-            type="password",
-            on_change=password_entered,
-            key="password",
-            placeholder="••••••"
-        )
-        attempts_left = MAX_ATTEMPTS - st.session_state["failed_attempts"]
-        if attempts_left > 0:
-            st.error(f"❌ PIN incorrecto. Te quedan {attempts_left} intento(s).")
-        st.markdown("</div>", unsafe_allow_html=True)
-        return False
+    if st.session_state.get("password_correct"):
+        # Password correct: remember the login for today (cookies can't be written from the callback)
+        if cookies is not None and st.session_state.pop("issue_auth_cookie", False):
+            cookies[AUTH_COOKIE] = auth_token()
+            cookies.save()
+        return True
     
-    # Password correct
-    return True
+    # First run, or a wrong PIN was entered
+    login_form()
+    return False
+
 
 # Check password before showing anything
 if not check_password():
     st.stop()
 
+# Plotly is only needed past the login screen, which no longer pays for its import
+import plotly.express as px
+
 # Custom CSS for Dark/Premium Look + Mobile Responsiveness
-st.markdown("""
+# (st.html passes it straight through instead of running the markdown parser)
+st.html("""
     <style>
     /* === BASE STYLES === */
     .main {
@@ -495,14 +582,41 @@ st.markdown("""
         }
     }
     </style>
-    """, unsafe_allow_html=True)
+    """)
 
 # Load Data
-import os
 # Path relative to src/ directory
 DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "source.csv")
 
-df = load_data(DATA_PATH)
+@st.cache_resource(show_spinner=False, max_entries=1)
+def shared_data(file_path, version):
+    """
+    The processed dataframe as one object shared by every rerun and session
+    (st.cache_data would hand each rerun its own unpickled copy). `version` (see data_version) is
+    only the cache key, so a changed file is re-read. Views must not modify it in place.
+    """
+    return load_data(file_path)
+
+
+# Keyed by the file's mtime/size so an upload through the API is picked up on the next rerun
+DATA_VERSION = data_version(DATA_PATH)
+df = shared_data(DATA_PATH, DATA_VERSION)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def filter_by_date(version, date_range):
+    """Rows of df between two dates (inclusive), shared read-only across reruns like df itself."""
+    start, end = (np.datetime64(d, 'D') for d in date_range)
+    # Compare on the datetime64 array; end bound is exclusive midnight of the next day
+    fechas = df['fecha'].to_numpy()
+    return df.loc[(fechas >= start) & (fechas < end + np.timedelta64(1, 'D'))]
+
+
+@st.cache_data(show_spinner=False)
+def date_bounds(version):
+    """First and last sale date in df; max_date is the "today" of the recency views."""
+    return df['fecha'].min(), df['fecha'].max()
+
 
 if df.empty:
     st.warning(f"No se encontraron datos en {DATA_PATH}. Por favor carga un archivo CSV en la sección de Configuración.")
@@ -557,8 +671,9 @@ else:
 # Sidebar Filters (Global)
 st.sidebar.markdown("---")
 st.sidebar.header("Filtros Globales")
-min_date = df['fecha'].min()
-max_date = df['fecha'].max()
+min_date, max_date = date_bounds(DATA_VERSION)
+
+filter_range = None  # (start, end) dates applied to filtered_df, None = all data
 
 if pd.isnull(min_date) or pd.isnull(max_date):
     st.sidebar.error("Error with date formats in CSV.")
@@ -578,45 +693,215 @@ else:
             max_value=max_date
         )
     else:
-        # Calculate range based on max_date from data
-        end_date = max_date
+        # Calculate range based on max_date from data (datetime64[D] arithmetic)
+        end_date = np.datetime64(max_date, 'D')
         if date_preset == "Este Año":
             # January 1st of current year to max_date
-            start_date = pd.Timestamp(year=max_date.year, month=1, day=1)
+            start_date = end_date.astype('datetime64[Y]').astype('datetime64[D]')
         elif date_preset == "Últimos 6 Meses":
-            start_date = end_date - pd.DateOffset(months=6)
+            start_date = months_before(end_date, 6)
         elif date_preset == "Últimos 3 Meses":
-            start_date = end_date - pd.DateOffset(months=3)
+            start_date = months_before(end_date, 3)
         elif date_preset == "Último Mes":
-            start_date = end_date - pd.DateOffset(months=1)
+            start_date = months_before(end_date, 1)
         elif date_preset == "Última Semana":
-            start_date = end_date - pd.DateOffset(weeks=1)
+            start_date = end_date - np.timedelta64(7, 'D')
         else: # Todos
-            start_date = min_date
+            start_date = np.datetime64(min_date, 'D')
             
         date_range = (start_date, end_date)
         # Show the range being applied
-        st.sidebar.caption(f"Del: {start_date.strftime('%d/%m/%Y')} al {end_date.strftime('%d/%m/%Y')}")
+        st.sidebar.caption(f"Del: {start_date.item():%d/%m/%Y} al {end_date.item():%d/%m/%Y}")
     
     # Apply Filter
     if len(date_range) == 2:
-        start_date, end_date = date_range
-        # Ensure we compare date objects
-        if isinstance(start_date, pd.Timestamp): start_date = start_date.date()
-        if isinstance(end_date, pd.Timestamp): end_date = end_date.date()
+        # Presets give datetime64[D], the date picker gives datetime.date
+        start_date, end_date = (np.datetime64(d, 'D') for d in date_range)
         
-        mask = (df['fecha'].dt.date >= start_date) & (df['fecha'].dt.date <= end_date)
-        filtered_df = df.loc[mask]
+        if start_date <= np.datetime64(min_date, 'D') and end_date >= np.datetime64(max_date, 'D'):
+            # Range covers all the data ("Todos"): no mask, no copy, same cache key as unfiltered
+            filtered_df = df
+        else:
+            filter_range = (start_date.item(), end_date.item())
+            filtered_df = filter_by_date(DATA_VERSION, filter_range)
     else:
         filtered_df = df
 
+# Dataset version + date range fully determine filtered_df; cached aggregations key on it
+FILTER_KEY = (DATA_VERSION, filter_range)
+
+# --- CACHED AGGREGATIONS ---
+# Streamlit reruns the whole script on every interaction; these keep the heavy groupbys
+# out of the rerun path. They read the module-level df / filtered_df, so the key argument
+# must identify that data (DATA_VERSION for df, FILTER_KEY for filtered_df).
+
+@st.cache_resource(show_spinner=False)
+def sorted_options(version, column):
+    """
+    Sorted distinct values of a df column for selectboxes (a Categorical already holds them sorted).
+    Shared, not copied: selectboxes only read the list.
+    """
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.categories.tolist()
+    return sorted(values.unique())
+
+
+@st.cache_data(show_spinner=False)
+def overview_aggs(filter_key):
+    """KPIs and chart tables for the overview."""
+    # Group by Month-Year for the trend line (label formatted per month, not per row)
+    sales_over_time = filtered_df.groupby('year_month')['venta_neta'].sum().reset_index()
+    sales_over_time['mes_anio'] = format_year_month(sales_over_time['year_month'])
+    
+    seasonality = filtered_df.groupby(['num_mes', 'nombre_mes'], observed=True)['venta_neta'].sum().reset_index()
+    avg_total = seasonality['venta_neta'].mean()
+    v = seasonality['venta_neta'].to_numpy()
+    seasonality['status'] = np.select([v > avg_total * 1.1, v < avg_total * 0.9], ['Alto', 'Bajo'], default='Normal')
+    
+    cat_sales = None
+    if 'categoria' in filtered_df.columns:
+        cat_sales = filtered_df.groupby('categoria', observed=True)['venta_neta'].sum().reset_index()
+    
+    return {
+        'kpis': get_kpis(filtered_df),
+        'sales_over_time': sales_over_time,
+        'seasonality': seasonality,
+        'top_products': filtered_df.groupby('producto', observed=True, sort=False)['venta_neta'].sum().nlargest(15).reset_index(),
+        'cat_sales': cat_sales,
+        'top_customers': filtered_df.groupby('cliente_nombre', observed=True, sort=False)['venta_neta'].sum().nlargest(10).reset_index()
+    }
+
+
+@st.cache_data(show_spinner=False)
+def category_monthly_trend(filter_key, column):
+    """Monthly sales per value of `column`, bucketed once for every category so switching the selection is a lookup."""
+    trend = filtered_df.groupby([column, 'year_month'], observed=True)['venta_neta'].sum().reset_index()
+    trend['mes_año'] = format_year_month(trend['year_month'])
+    return trend
+
+
+@st.cache_data(show_spinner=False)
+def cached_figure(chart, data, **kwargs):
+    """px.<chart>(data, **kwargs) memoized on the data and arguments: reruns copy the figure instead of rebuilding it."""
+    return getattr(px, chart)(data, **kwargs)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def row_buckets(filter_key, column):
+    """Positions in filtered_df of each value of `column`, built once so picking a value is a lookup, not a scan."""
+    return filtered_df.groupby(column, observed=True, sort=False).indices
+
+
+@st.cache_data(show_spinner=False)
+def category_detail(filter_key, column, value):
+    """Totals, original categories and top-20 products for one value of `column`, so reruns and tab clicks skip the slice."""
+    return category_summary(filtered_df.take(row_buckets(filter_key, column).get(value, [])))
+
+
+@st.cache_data(show_spinner=False)
+def category_stats(filter_key, column='categoria'):
+    """Per-category (or per-`column`, e.g. categoria_base) totals for the filtered data, best-selling first."""
+    cat_stats = filtered_df.groupby(column, observed=True).agg({
+        'venta_neta': 'sum',
+        'cantidad': 'sum',
+        'factura_id': 'nunique',
+        'cliente_nombre': 'nunique',
+        'producto': 'nunique'
+    }).reset_index()
+    cat_stats.columns = ['Categoría', 'Ventas', 'Cantidad', 'Transacciones', 'Clientes', 'Productos']
+    return cat_stats.sort_values('Ventas', ascending=False)
+
+
+@st.cache_data(show_spinner=False)
+def top_product_stats(filter_key, top_n=30):
+    """Number of products sold in the filtered range and the top_n of them by sales."""
+    stats = filtered_df.groupby('producto', observed=True, sort=False).agg({
+        'venta_neta': 'sum',
+        'cantidad': 'sum',
+        'cliente_nombre': 'nunique',
+        'fecha': ['max', 'count']
+    }).reset_index()
+    stats.columns = ['Producto', 'Ventas', 'Cantidad', 'Clientes', 'Última Venta', 'Transacciones']
+    return {'total': len(stats), 'top': stats.nlargest(top_n, 'Ventas')}
+
+
+@st.cache_data(show_spinner=False)
+def product_stats(version):
+    """Global per-product totals, customers, last sale, transactions and days since the last sale."""
+    stats = df.groupby('producto', observed=True).agg(
+        venta_neta=('venta_neta', 'sum'),
+        cantidad=('cantidad', 'sum'),
+        clientes=('cliente_nombre', 'nunique'),
+        ultima_venta=('fecha', 'max'),
+        transacciones=('fecha', 'count')
+    ).reset_index()
+    stats['dias_sin_venta'] = days_since(max_date, stats['ultima_venta'])
+    return stats
+
+
+@st.cache_data(show_spinner=False)
+def product_recency_stats(version):
+    """Global sales and days since last sale per product."""
+    prod_stats = product_stats(version)[['producto', 'venta_neta', 'ultima_venta', 'dias_sin_venta']]
+    prod_stats = prod_stats.rename(columns={'ultima_venta': 'fecha'})
+    prod_stats['estado'] = np.where(prod_stats['dias_sin_venta'] > 90, 'Alerta (>90 días)', 'Activo')
+    return prod_stats
+
+
+@st.cache_data(show_spinner=False)
+def customer_stats(filter_key, by=None):
+    """
+    Per-customer totals, first/last purchase, transactions and days since the last purchase.
+    With `by` the stats are per (by, customer) for every value at once; views pick theirs with
+    customers_of(). Without it they also count distinct invoices (facturas), for RFM.
+    filter_key[1] None means the full df, otherwise filtered_df.
+    """
+    source = df if filter_key[1] is None else filtered_df
+    keys = [by, 'cliente_nombre'] if by else ['cliente_nombre']
+    # One groupby, each column through its own cython kernel: same frame as the named
+    # .agg(), about half the time (the sums keep pandas' compensated summation)
+    grouped = source.groupby(keys, observed=True)
+    stats = grouped[['venta_neta', 'cantidad']].sum()
+    fechas = grouped['fecha']
+    stats['primera_compra'] = fechas.min()
+    stats['ultima_compra'] = fechas.max()
+    stats['transacciones'] = fechas.count()
+    if not by:
+        stats['facturas'] = grouped['factura_id'].nunique()
+    stats = stats.reset_index()
+    stats['dias_sin_compra'] = days_since(source['fecha'].max(), stats['ultima_compra'])
+    return stats
+
+
+def customers_of(stats, by, value):
+    """Rows of a customer_stats(..., by) frame for one value of `by`."""
+    return stats[stats[by] == value].drop(columns=by).reset_index(drop=True)
+
+
+@st.cache_data(show_spinner=False)
+def relevant_customer_recency(version):
+    """Global recency for customers with >7 transactions or >$10,000 in sales."""
+    cust_global = customer_stats((version, None))
+    cust_global = cust_global[['cliente_nombre', 'venta_neta', 'ultima_compra', 'transacciones', 'dias_sin_compra']]
+    cust_global.columns = ['cliente', 'venta_neta', 'fecha', 'transacciones', 'dias_sin_compra']
+    
+    # Filter: >7 transactions OR >$10,000 in sales
+    cust_global = cust_global[(cust_global['transacciones'] > 7) | (cust_global['venta_neta'] > 10000)].copy()
+    
+    cust_global['estado'] = np.where(cust_global['dias_sin_compra'] > 90, 'Alerta (>90 días)', 'Activo')
+    return cust_global
+
 # --- VIEW FUNCTIONS ---
 
 def render_overview():
     st.title("📊 Visión General")
     
+    # Aggregations and figures are both cached, so reruns skip the groupbys and the plotly builds
+    aggs = overview_aggs(FILTER_KEY)
+    
     # KPIs
-    kpis = get_kpis(filtered_df)
+    kpis = aggs['kpis']
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Ventas Totales", f"${kpis['total_revenue']:,.2f}")
     c2.metric("Total Pedidos", f"{kpis['total_orders']:,}")
@@ -630,36 +915,27 @@ def render_overview():
 
     with col1:
         st.subheader("Tendencia de Ventas (Mensual)")
-        # Group by Month-Year for the trend line
-        filtered_df['mes_anio'] = filtered_df['fecha'].dt.to_period('M').astype(str)
-        sales_over_time = filtered_df.groupby('mes_anio')['venta_neta'].sum().reset_index()
-        fig_line = px.line(sales_over_time, x='mes_anio', y='venta_neta', title='Ventas Mensuales', template='plotly_dark', markers=True)
+        sales_over_time = aggs['sales_over_time']
+        fig_line = cached_figure('line', sales_over_time, x='mes_anio', y='venta_neta', title='Ventas Mensuales', template='plotly_dark', markers=True)
         fig_line.update_layout(xaxis_title="Mes", yaxis_title="Ventas ($)")
         st.plotly_chart(fig_line, use_container_width=True)
 
         # Seasonality Analysis
         st.subheader("Estacionalidad: ¿Cuándo se vende más?")
-        filtered_df['nombre_mes'] = filtered_df['fecha'].dt.month_name()
-        filtered_df['num_mes'] = filtered_df['fecha'].dt.month
-        
-        seasonality = filtered_df.groupby(['num_mes', 'nombre_mes'])['venta_neta'].sum().reset_index()
-        avg_total = seasonality['venta_neta'].mean()
-        seasonality['status'] = seasonality['venta_neta'].apply(
-            lambda x: 'Alto' if x > avg_total * 1.1 else ('Bajo' if x < avg_total * 0.9 else 'Normal')
-        )
+        seasonality = aggs['seasonality']
         color_map = {'Alto': '#00cc96', 'Normal': '#636efa', 'Bajo': '#ef553b'}
         
-        fig_season = px.bar(seasonality, x='nombre_mes', y='venta_neta', 
-                            title='Ventas Totales por Mes (Estacionalidad)',
-                            color='status', color_discrete_map=color_map,
-                            template='plotly_dark')
+        fig_season = cached_figure('bar', seasonality, x='nombre_mes', y='venta_neta', 
+                                   title='Ventas Totales por Mes (Estacionalidad)',
+                                   color='status', color_discrete_map=color_map,
+                                   template='plotly_dark')
         fig_season.update_layout(xaxis={'categoryorder': 'array', 'categoryarray': ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']})
         st.plotly_chart(fig_season, use_container_width=True)
 
     with col2:
         st.subheader("Top Productos")
-        top_products = filtered_df.groupby('producto')['venta_neta'].sum().nlargest(15).reset_index()
-        fig_bar = px.bar(top_products, x='venta_neta', y='producto', orientation='h', title='Top Productos por Ingresos', template='plotly_dark', color='venta_neta')
+        top_products = aggs['top_products']
+        fig_bar = cached_figure('bar', top_products, x='venta_neta', y='producto', orientation='h', title='Top Productos por Ingresos', template='plotly_dark', color='venta_neta')
         fig_bar.update_layout(yaxis={'categoryorder': 'total ascending'}, xaxis_title="Ingresos ($)", yaxis_title="Producto")
         st.plotly_chart(fig_bar, use_container_width=True)
 
@@ -668,39 +944,31 @@ def render_overview():
 
     with col3:
         st.subheader("Ventas por Categoría")
-        if 'categoria' in filtered_df.columns:
-            cat_sales = filtered_df.groupby('categoria')['venta_neta'].sum().reset_index()
-            fig_pie = px.pie(cat_sales, values='venta_neta', names='categoria', title='Distribución por Categoría', template='plotly_dark')
+        if aggs['cat_sales'] is not None:
+            cat_sales = aggs['cat_sales']
+            fig_pie = cached_figure('pie', cat_sales, values='venta_neta', names='categoria', title='Distribución por Categoría', template='plotly_dark')
             st.plotly_chart(fig_pie, use_container_width=True)
         else:
             st.info("Columna 'categoria' no encontrada.")
 
     with col4:
         st.subheader("Top Clientes")
-        top_customers = filtered_df.groupby('cliente_nombre')['venta_neta'].sum().nlargest(10).reset_index()
-        fig_cust = px.bar(top_customers, x='cliente_nombre', y='venta_neta', title='Top 10 Clientes', template='plotly_dark')
+        top_customers = aggs['top_customers']
+        fig_cust = cached_figure('bar', top_customers, x='cliente_nombre', y='venta_neta', title='Top 10 Clientes', template='plotly_dark')
         st.plotly_chart(fig_cust, use_container_width=True)
 
 
 def render_recency_analysis():
     st.title("⏳ Análisis de Recencia (Riesgo de Fuga)")
     st.caption("Identifica productos o clientes en riesgo de inactividad (>90 días).")
-    
-    max_recency_date = df['fecha'].max()
 
     # 1. Product Recency (Global)
     st.subheader("1. Estado de Productos (Global)")
 
-    prod_stats = df.groupby('producto').agg({
-        'venta_neta': 'sum',
-        'fecha': 'max'
-    }).reset_index()
-
-    prod_stats['dias_sin_venta'] = (max_recency_date - prod_stats['fecha']).dt.days
-    prod_stats['estado'] = prod_stats['dias_sin_venta'].apply(lambda x: 'Alerta (>90 días)' if x > 90 else 'Activo')
+    prod_stats = product_recency_stats(DATA_VERSION)
 
     fig_prod_recency = px.scatter(
-        prod_stats, 
+        plot_frame(prod_stats, ['dias_sin_venta', 'venta_neta', 'estado', 'producto']),
         x='dias_sin_venta', 
         y='venta_neta', 
         color='estado',
@@ -713,25 +981,24 @@ def render_recency_analysis():
     st.plotly_chart(fig_prod_recency, use_container_width=True)
 
     # 2. Customer Recency
+    product_customer_recency()
+
+
+@st.fragment
+def product_customer_recency():
+    """Customers of the selected product. A fragment: changing the product reruns only this part."""
     st.subheader("2. Análisis de Clientes por Producto")
-    unique_products = sorted(df['producto'].unique())
+    unique_products = sorted_options(DATA_VERSION, 'producto')
     selected_prod = st.selectbox("Selecciona un Producto:", unique_products)
 
     if selected_prod:
-        prod_df = df[df['producto'] == selected_prod]
+        cust_stats = customers_of(customer_stats((DATA_VERSION, None), 'producto'), 'producto', selected_prod)
         
-        if not prod_df.empty:
-            cust_stats = prod_df.groupby('cliente_nombre').agg({
-                'venta_neta': 'sum',
-                'fecha': 'max',
-                'cantidad': 'sum'
-            }).reset_index()
-            
-            cust_stats['dias_sin_compra'] = (max_recency_date - cust_stats['fecha']).dt.days
-            cust_stats['estado'] = cust_stats['dias_sin_compra'].apply(lambda x: 'Inactivo (>90 días)' if x > 90 else 'Activo')
+        if not cust_stats.empty:
+            cust_stats['estado'] = np.where(cust_stats['dias_sin_compra'] > 90, 'Inactivo (>90 días)', 'Activo')
             
             fig_cust_recency = px.scatter(
-                cust_stats, 
+                plot_frame(cust_stats, ['dias_sin_compra', 'venta_neta', 'cantidad', 'estado', 'cliente_nombre']),
                 x='dias_sin_compra', 
                 y='venta_neta',
                 size='cantidad',
@@ -755,28 +1022,14 @@ def render_customer_deep_dive():
     st.title("🔎 Explorador de Clientes")
     st.caption("Investigación profunda del historial de compras por cliente.")
     
-    max_recency_date = df['fecha'].max()
-    
     # Global Customer Recency Chart
     st.subheader("📊 Estado de Clientes (Global)")
     st.caption("Muestra solo clientes con más de 7 transacciones o compras superiores a $10,000")
     
-    cust_global = df.groupby('cliente_nombre').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count']
-    }).reset_index()
-    cust_global.columns = ['cliente', 'venta_neta', 'fecha', 'transacciones']
-    
-    # Filter: >7 transactions OR >$10,000 in sales
-    cust_global = cust_global[(cust_global['transacciones'] > 7) | (cust_global['venta_neta'] > 10000)]
-    
-    cust_global['dias_sin_compra'] = (max_recency_date - cust_global['fecha']).dt.days
-    cust_global['estado'] = cust_global['dias_sin_compra'].apply(
-        lambda x: 'Alerta (>90 días)' if x > 90 else 'Activo'
-    )
+    cust_global = relevant_customer_recency(DATA_VERSION)
     
     fig_cust_global = px.scatter(
-        cust_global,
+        plot_frame(cust_global, ['dias_sin_compra', 'venta_neta', 'estado', 'cliente', 'transacciones']),
         x='dias_sin_compra',
         y='venta_neta',
         color='estado',
@@ -792,8 +1045,14 @@ def render_customer_deep_dive():
     st.markdown("---")
     
     # Individual Customer Lookup
+    customer_lookup()
+
+
+@st.fragment
+def customer_lookup():
+    """Metrics and product portfolio of one customer. A fragment: switching customers reruns only this part."""
     st.subheader("🔍 Búsqueda de Cliente Individual")
-    unique_customers = sorted(df['cliente_nombre'].unique())
+    unique_customers = sorted_options(DATA_VERSION, 'cliente_nombre')
     selected_customer = st.selectbox("Buscar Cliente:", unique_customers)
 
     if selected_customer:
@@ -806,14 +1065,14 @@ def render_customer_deep_dive():
             col_metrics3.metric("Última Compra", cust_df['fecha'].max().strftime('%d/%m/%Y'))
             
             st.subheader("Portafolio de Productos")
-            cust_prods = cust_df.groupby('producto').agg({
+            cust_prods = cust_df.groupby('producto', observed=True).agg({
                 'cantidad': 'sum',
                 'venta_neta': 'sum',
                 'fecha': 'max'
             }).reset_index()
             
-            cust_prods['dias_sin_compra'] = (max_recency_date - cust_prods['fecha']).dt.days
-            cust_prods['estado'] = cust_prods['dias_sin_compra'].apply(lambda x: 'Alerta (>90 días)' if x > 90 else 'Activo')
+            cust_prods['dias_sin_compra'] = days_since(max_date, cust_prods['fecha'])
+            cust_prods['estado'] = np.where(cust_prods['dias_sin_compra'] > 90, 'Alerta (>90 días)', 'Activo')
             
             fig_cust_prods = px.bar(
                 cust_prods,
@@ -837,15 +1096,7 @@ def render_category_analysis():
         return
     
     # Category overview metrics
-    cat_stats = filtered_df.groupby('categoria').agg({
-        'venta_neta': 'sum',
-        'cantidad': 'sum',
-        'factura_id': 'nunique',
-        'cliente_nombre': 'nunique',
-        'producto': 'nunique'
-    }).reset_index()
-    cat_stats.columns = ['Categoría', 'Ventas', 'Cantidad', 'Transacciones', 'Clientes', 'Productos']
-    cat_stats = cat_stats.sort_values('Ventas', ascending=False)
+    cat_stats = category_stats(FILTER_KEY)
     
     # Top KPIs
     col1, col2, col3 = st.columns(3)
@@ -894,6 +1145,16 @@ def render_category_analysis():
     st.markdown("---")
     
     # Category Deep Dive
+    category_deep_dive(cat_stats)
+    
+    st.markdown("---")
+    st.subheader("📊 Tabla Completa de Categorías")
+    st.dataframe(cat_stats, hide_index=True, use_container_width=True)
+
+
+@st.fragment
+def category_deep_dive(cat_stats):
+    """Metrics and customer/product/trend tabs for the selected category. A fragment: changing the category reruns only this part."""
     st.subheader("🔍 Análisis Detallado por Categoría")
     
     # Category selector
@@ -903,18 +1164,18 @@ def render_category_analysis():
     )
     
     if selected_cat:
-        cat_df = filtered_df[filtered_df['categoria'] == selected_cat]
+        detail = category_detail(FILTER_KEY, 'categoria', selected_cat)
         
         # Category metrics
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Ventas Totales", f"${cat_df['venta_neta'].sum():,.0f}")
+            st.metric("Ventas Totales", f"${detail['ventas']:,.0f}")
         with col2:
-            st.metric("Cantidad Vendida", f"{cat_df['cantidad'].sum():,.0f}")
+            st.metric("Cantidad Vendida", f"{detail['cantidad']:,.0f}")
         with col3:
-            st.metric("Clientes Únicos", cat_df['cliente_nombre'].nunique())
+            st.metric("Clientes Únicos", detail['clientes'])
         with col4:
-            st.metric("Productos", cat_df['producto'].nunique())
+            st.metric("Productos", detail['productos'])
         
         st.markdown("---")
         
@@ -925,24 +1186,17 @@ def render_category_analysis():
             st.subheader(f"Clientes que Compran {selected_cat[:30]}")
             
             # Customer breakdown for this category
-            cust_cat = cat_df.groupby('cliente_nombre').agg({
-                'venta_neta': 'sum',
-                'cantidad': 'sum',
-                'fecha': ['min', 'max', 'count']
-            }).reset_index()
-            cust_cat.columns = ['Cliente', 'Ventas', 'Cantidad', 'Primera Compra', 'Última Compra', 'Transacciones']
-            cust_cat = cust_cat.sort_values('Ventas', ascending=False)
+            cust_cat = customers_of(customer_stats(FILTER_KEY, 'categoria'), 'categoria', selected_cat)
+            cust_cat.columns = ['Cliente', 'Ventas', 'Cantidad', 'Primera Compra', 'Última Compra', 'Transacciones', 'Días Sin Comprar']
+            cust_cat = cust_cat.nlargest(20, 'Ventas')  # only the top 20 are shown
             
-            # Days since last purchase
-            today = filtered_df['fecha'].max()
-            cust_cat['Días Sin Comprar'] = (today - cust_cat['Última Compra']).dt.days
-            cust_cat['Estado'] = cust_cat['Días Sin Comprar'].apply(
-                lambda x: '🔴 Inactivo' if x > 90 else ('🟡 En Riesgo' if x > 30 else '🟢 Activo')
-            )
+            d = cust_cat['Días Sin Comprar'].to_numpy()
+            cust_cat['Estado'] = np.select([d > 90, d > 30], ['🔴 Inactivo', '🟡 En Riesgo'], default='🟢 Activo')
             
             # Top customers chart
             top_custs = cust_cat.head(15)
-            fig_custs = px.bar(
+            fig_custs = cached_figure(
+                'bar',
                 top_custs,
                 x='Ventas',
                 y='Cliente',
@@ -965,18 +1219,12 @@ def render_category_analysis():
             st.subheader(f"Productos en {selected_cat[:30]}")
             
             # Product breakdown
-            prod_cat = cat_df.groupby('producto').agg({
-                'venta_neta': 'sum',
-                'cantidad': 'sum',
-                'cliente_nombre': 'nunique',
-                'fecha': 'max'
-            }).reset_index()
-            prod_cat.columns = ['Producto', 'Ventas', 'Cantidad', 'Clientes', 'Última Venta']
-            prod_cat = prod_cat.sort_values('Ventas', ascending=False)
+            prod_cat = detail['top_productos']
             
             # Products chart
             top_prods = prod_cat.head(15)
-            fig_prods = px.bar(
+            fig_prods = cached_figure(
+                'bar',
                 top_prods,
                 x='Ventas',
                 y='Producto',
@@ -998,15 +1246,12 @@ def render_category_analysis():
         with tab3:
             st.subheader(f"Tendencia Mensual - {selected_cat[:30]}")
             
-            # Create month column for grouping
-            cat_df_trend = cat_df.copy()
-            cat_df_trend['mes_año'] = cat_df_trend['fecha'].dt.to_period('M').astype(str)
-            
             # Monthly trend for category
-            cat_trend = cat_df_trend.groupby('mes_año')['venta_neta'].sum().reset_index()
-            cat_trend = cat_trend.sort_values('mes_año')
+            cat_trend = category_monthly_trend(FILTER_KEY, 'categoria')
+            cat_trend = cat_trend[cat_trend['categoria'] == selected_cat]
             
-            fig_trend = px.line(
+            fig_trend = cached_figure(
+                'line',
                 cat_trend,
                 x='mes_año',
                 y='venta_neta',
@@ -1016,22 +1261,6 @@ def render_category_analysis():
             )
             fig_trend.update_traces(line_color='#00d4aa', marker_size=8)
             st.plotly_chart(fig_trend, use_container_width=True)
-    
-    st.markdown("---")
-    st.subheader("📊 Tabla Completa de Categorías")
-    st.dataframe(cat_stats, hide_index=True, use_container_width=True)
-
-
-def get_base_category(cat):
-    """Extract base category name by removing numeric suffix."""
-    import re
-    if not isinstance(cat, str):
-        return 'OTROS'
-    # Remove numbers and dashes at the end, keep the base name
-    # Examples: TELA AUTO-1000 -> TELA AUTO, PVC BONDE -3116 -> PVC BONDE
-    base = re.sub(r'[\s-]*[\d]+$', '', cat).strip()
-    base = re.sub(r'[\s-]+$', '', base).strip()
-    return base if base else cat
 
 
 def render_grouped_category_analysis():
@@ -1042,20 +1271,8 @@ def render_grouped_category_analysis():
         st.warning("No hay datos de categoría disponibles.")
         return
     
-    # Create grouped category column
-    df_grouped = filtered_df.copy()
-    df_grouped['categoria_base'] = df_grouped['categoria'].apply(get_base_category)
-    
-    # Category overview metrics
-    cat_stats = df_grouped.groupby('categoria_base').agg({
-        'venta_neta': 'sum',
-        'cantidad': 'sum',
-        'factura_id': 'nunique',
-        'cliente_nombre': 'nunique',
-        'producto': 'nunique'
-    }).reset_index()
-    cat_stats.columns = ['Categoría', 'Ventas', 'Cantidad', 'Transacciones', 'Clientes', 'Productos']
-    cat_stats = cat_stats.sort_values('Ventas', ascending=False)
+    # Category overview metrics (categoria_base is built once in load_data)
+    cat_stats = category_stats(FILTER_KEY, 'categoria_base')
     
     # Top KPIs
     col1, col2, col3 = st.columns(3)
@@ -1104,6 +1321,16 @@ def render_grouped_category_analysis():
     st.markdown("---")
     
     # Group Deep Dive
+    group_deep_dive(cat_stats)
+    
+    st.markdown("---")
+    st.subheader("📊 Tabla Completa de Grupos")
+    st.dataframe(cat_stats, hide_index=True, use_container_width=True)
+
+
+@st.fragment
+def group_deep_dive(cat_stats):
+    """Original categories, metrics and tabs for the selected group. A fragment: changing the group reruns only this part."""
     st.subheader("🔍 Análisis Detallado por Grupo")
     
     # Group selector
@@ -1114,25 +1341,25 @@ def render_grouped_category_analysis():
     )
     
     if selected_group:
-        group_df = df_grouped[df_grouped['categoria_base'] == selected_group]
+        detail = category_detail(FILTER_KEY, 'categoria_base', selected_group)
         
         # Show which original categories are included
-        original_cats = group_df['categoria'].unique()
+        original_cats = detail['categorias']
         with st.expander(f"📋 Incluye {len(original_cats)} categorías originales"):
-            st.write(", ".join(sorted(original_cats)[:20]))
+            st.write(", ".join(original_cats[:20]))
             if len(original_cats) > 20:
                 st.caption(f"... y {len(original_cats) - 20} más")
         
         # Group metrics
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Ventas Totales", f"${group_df['venta_neta'].sum():,.0f}")
+            st.metric("Ventas Totales", f"${detail['ventas']:,.0f}")
         with col2:
-            st.metric("Cantidad Vendida", f"{group_df['cantidad'].sum():,.0f}")
+            st.metric("Cantidad Vendida", f"{detail['cantidad']:,.0f}")
         with col3:
-            st.metric("Clientes Únicos", group_df['cliente_nombre'].nunique())
+            st.metric("Clientes Únicos", detail['clientes'])
         with col4:
-            st.metric("Productos", group_df['producto'].nunique())
+            st.metric("Productos", detail['productos'])
         
         st.markdown("---")
         
@@ -1142,22 +1369,16 @@ def render_grouped_category_analysis():
         with tab1:
             st.subheader(f"Clientes que Compran {selected_group[:30]}")
             
-            cust_grp = group_df.groupby('cliente_nombre').agg({
-                'venta_neta': 'sum',
-                'cantidad': 'sum',
-                'fecha': ['min', 'max', 'count']
-            }).reset_index()
-            cust_grp.columns = ['Cliente', 'Ventas', 'Cantidad', 'Primera Compra', 'Última Compra', 'Transacciones']
-            cust_grp = cust_grp.sort_values('Ventas', ascending=False)
+            cust_grp = customers_of(customer_stats(FILTER_KEY, 'categoria_base'), 'categoria_base', selected_group)
+            cust_grp.columns = ['Cliente', 'Ventas', 'Cantidad', 'Primera Compra', 'Última Compra', 'Transacciones', 'Días Sin Comprar']
+            cust_grp = cust_grp.nlargest(20, 'Ventas')  # only the top 20 are shown
             
-            today = filtered_df['fecha'].max()
-            cust_grp['Días Sin Comprar'] = (today - cust_grp['Última Compra']).dt.days
-            cust_grp['Estado'] = cust_grp['Días Sin Comprar'].apply(
-                lambda x: '🔴 Inactivo' if x > 90 else ('🟡 En Riesgo' if x > 30 else '🟢 Activo')
-            )
+            d = cust_grp['Días Sin Comprar'].to_numpy()
+            cust_grp['Estado'] = np.select([d > 90, d > 30], ['🔴 Inactivo', '🟡 En Riesgo'], default='🟢 Activo')
             
             top_custs = cust_grp.head(15)
-            fig_custs = px.bar(
+            fig_custs = cached_figure(
+                'bar',
                 top_custs,
                 x='Ventas',
                 y='Cliente',
@@ -1178,17 +1399,11 @@ def render_grouped_category_analysis():
         with tab2:
             st.subheader(f"Productos en {selected_group[:30]}")
             
-            prod_grp = group_df.groupby('producto').agg({
-                'venta_neta': 'sum',
-                'cantidad': 'sum',
-                'cliente_nombre': 'nunique',
-                'fecha': 'max'
-            }).reset_index()
-            prod_grp.columns = ['Producto', 'Ventas', 'Cantidad', 'Clientes', 'Última Venta']
-            prod_grp = prod_grp.sort_values('Ventas', ascending=False)
+            prod_grp = detail['top_productos']
             
             top_prods = prod_grp.head(15)
-            fig_prods = px.bar(
+            fig_prods = cached_figure(
+                'bar',
                 top_prods,
                 x='Ventas',
                 y='Producto',
@@ -1205,13 +1420,11 @@ def render_grouped_category_analysis():
         with tab3:
             st.subheader(f"Tendencia Mensual - {selected_group[:30]}")
             
-            group_df_trend = group_df.copy()
-            group_df_trend['mes_año'] = group_df_trend['fecha'].dt.to_period('M').astype(str)
-            
-            grp_trend = group_df_trend.groupby('mes_año')['venta_neta'].sum().reset_index()
-            grp_trend = grp_trend.sort_values('mes_año')
+            grp_trend = category_monthly_trend(FILTER_KEY, 'categoria_base')
+            grp_trend = grp_trend[grp_trend['categoria_base'] == selected_group]
             
-            fig_trend = px.line(
+            fig_trend = cached_figure(
+                'line',
                 grp_trend,
                 x='mes_año',
                 y='venta_neta',
@@ -1221,31 +1434,85 @@ def render_grouped_category_analysis():
             )
             fig_trend.update_traces(line_color='#00d4aa', marker_size=8)
             st.plotly_chart(fig_trend, use_container_width=True)
+
+
+def monthly_comparison(dataframe, key, label, meses, top_n=20):
+    """Top-N sales per key in the current month next to the two previous months (one pass, no merges)."""
+    monthly = monthly_sums_by_key(dataframe, key, 'num_mes', meses)
     
-    st.markdown("---")
-    st.subheader("📊 Tabla Completa de Grupos")
-    st.dataframe(cat_stats, hide_index=True, use_container_width=True)
+    # Only keys that sold in the current month compete for the top N
+    actual = monthly[meses[0]].values
+    comp = monthly.iloc[top_k(actual, top_n, mask=~np.isnan(actual))].fillna(0)
+    comp.columns = ['Mes Actual', 'Mes Anterior', 'Hace 2 Meses']
+    comp = comp.rename_axis(label).reset_index()
+    comp['Cambio vs Anterior'] = comp['Mes Actual'] - comp['Mes Anterior']
+    comp['Cambio vs Hace 2'] = comp['Mes Actual'] - comp['Hace 2 Meses']
+    return comp.round(2)
+
+
+@st.cache_data(show_spinner=False)
+def reminder_tables(version):
+    """All the tables behind the reminders view, built once per dataset instead of on every rerun."""
+    today = max_date
+    current_month = today.month
+    meses = [shift_month(current_month, k) for k in range(3)]
+    
+    # Get sales for current month across all years (only the two columns involved, one frame at the end)
+    month_rows = df['num_mes'] == current_month
+    yearly_sales = (df['venta_neta'][month_rows].groupby(df['num_anio'][month_rows]).sum()
+                    .sort_index(ascending=False).rename_axis('año').reset_index(name='ventas'))
+    
+    # Customers: same per-customer grouping as the recency views
+    cust_stats = customer_stats((version, None))
+    cust_stats = cust_stats[['cliente_nombre', 'venta_neta', 'ultima_compra', 'transacciones', 'dias_sin_compra']]
+    cust_stats.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones', 'dias_sin_compra']
+    
+    # Filter relevant (>3 transactions OR >$5000)
+    relevant = cust_stats[(cust_stats['transacciones'] > 3) | (cust_stats['total_ventas'] > 5000)]
+    inactive = relevant[relevant['dias_sin_compra'] > 90].sort_values('total_ventas', ascending=False)
+    
+    prod_stats = product_stats(version)[['producto', 'venta_neta', 'ultima_venta', 'transacciones', 'dias_sin_venta']]
+    prod_stats.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones', 'dias_sin_venta']
+    
+    # Top 50 products by sales
+    top_products = prod_stats.iloc[top_k(prod_stats['total_ventas'].values, 50)]
+    stale = top_products[top_products['dias_sin_venta'] > 60]  # top_k already ordered by ventas
+    
+    # Full formatted tables for the inactive/stale views: strings built once per dataset, not per rerun
+    inactive_display = inactive.copy()
+    inactive_display['ultima_compra'] = inactive_display['ultima_compra'].dt.strftime('%d/%m/%Y')
+    inactive_display['total_ventas'] = inactive_display['total_ventas'].map('${:,.2f}'.format)
+    inactive_display.columns = ['Cliente', 'Ventas Totales', 'Última Compra', 'Transacciones', 'Días Inactivo']
+    
+    stale_display = stale.copy()
+    stale_display['ultima_venta'] = stale_display['ultima_venta'].dt.strftime('%d/%m/%Y')
+    stale_display['total_ventas'] = stale_display['total_ventas'].map('${:,.2f}'.format)
+    
+    return {
+        'meses': meses,
+        'yearly_sales': yearly_sales,
+        'inactive': inactive,
+        'stale': stale,
+        # Arrow tables: the full lists go to st.dataframe without a pandas conversion per rerun
+        'inactive_display': pa.Table.from_pandas(inactive_display, preserve_index=False),
+        'stale_display': pa.Table.from_pandas(stale_display, preserve_index=False),
+        'comp_clientes': pa.Table.from_pandas(monthly_comparison(df, 'cliente_nombre', 'Cliente', meses), preserve_index=False),
+        'comp_productos': pa.Table.from_pandas(monthly_comparison(df, 'producto', 'Producto', meses), preserve_index=False)
+    }
 
 
 def render_reminders():
     st.title("📢 Recordatorios de Negocio")
     st.caption("Insights valiosos para la toma de decisiones. API disponible en puerto 8502.")
     
-    today = df['fecha'].max()
-    current_month = today.month
+    today = max_date
     current_year = today.year
+    tables = reminder_tables(DATA_VERSION)
     
     # --- 1. SALES TARGET ---
     st.subheader("🎯 Meta de Ventas del Mes")
     
-    # Get sales for current month across all years
-    df_month = df[df['fecha'].dt.month == current_month].copy()
-    yearly_sales = df_month.groupby(df_month['fecha'].dt.year).agg({
-        'venta_neta': 'sum'
-    }).reset_index()
-    yearly_sales.columns = ['año', 'ventas']
-    yearly_sales = yearly_sales.sort_values('año', ascending=False)
-    
+    yearly_sales = tables['yearly_sales']
     historical = yearly_sales[yearly_sales['año'] < current_year]
     current = yearly_sales[yearly_sales['año'] == current_year]
     
@@ -1253,7 +1520,7 @@ def render_reminders():
     max_sales = historical['ventas'].max() if not historical.empty else 0
     current_sales = current['ventas'].sum() if not current.empty else 0
     
-    days_in_month = 31  # Simplified
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
     days_elapsed = today.day
     projected = (current_sales / days_elapsed * days_in_month) if days_elapsed > 0 else 0
     meta = avg_sales * 1.1  # 10% above average
@@ -1266,12 +1533,13 @@ def render_reminders():
     col4.metric("% de Meta", f"{pct:.1f}%", delta=f"{pct-100:.1f}%" if pct != 0 else None)
     
     # Progress bar
-    progress = min(pct / 100, 1.0)
+    progress = min(max(pct / 100, 0.0), 1.0)  # st.progress rejects values outside [0, 1]
     st.progress(progress, text=f"Progreso hacia la meta: {pct:.1f}%")
     
     # Historical comparison chart
     if not yearly_sales.empty:
-        fig_hist = px.bar(
+        fig_hist = cached_figure(
+            'bar',
             yearly_sales,
             x='año',
             y='ventas',
@@ -1288,16 +1556,7 @@ def render_reminders():
     # --- 2. INACTIVE CUSTOMERS ---
     st.subheader("👥 Clientes Inactivos (>90 días)")
     
-    cust_stats = df.groupby('cliente_nombre').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count']
-    }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones']
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
-    
-    # Filter relevant (>3 transactions OR >$5000)
-    relevant = cust_stats[(cust_stats['transacciones'] > 3) | (cust_stats['total_ventas'] > 5000)]
-    inactive = relevant[relevant['dias_sin_compra'] > 90].sort_values('total_ventas', ascending=False)
+    inactive = tables['inactive']
     
     col1, col2 = st.columns(2)
     col1.metric("Clientes en Riesgo", len(inactive))
@@ -1318,16 +1577,7 @@ def render_reminders():
     # --- 3. STALE TOP PRODUCTS ---
     st.subheader("📦 Productos Top Sin Movimiento (>60 días)")
     
-    prod_stats = df.groupby('producto').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count']
-    }).reset_index()
-    prod_stats.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones']
-    prod_stats['dias_sin_venta'] = (today - prod_stats['ultima_venta']).dt.days
-    
-    # Top 50 products by sales
-    top_products = prod_stats.nlargest(50, 'total_ventas')
-    stale = top_products[top_products['dias_sin_venta'] > 60].sort_values('total_ventas', ascending=False)
+    stale = tables['stale']
     
     col1, col2 = st.columns(2)
     col1.metric("Productos Afectados", len(stale))
@@ -1348,52 +1598,22 @@ def render_reminders():
     # --- 4. COMPARACIÓN MENSUAL DE CLIENTES (3 MESES) ---
     st.subheader("📊 Top Clientes - Comparación 3 Meses")
     
-    def get_month_num(current, offset):
-        m = current - offset
-        if m <= 0:
-            m += 12
-        return m
-    
-    mes_actual = current_month
-    mes_anterior = get_month_num(current_month, 1)
-    mes_anterior_2 = get_month_num(current_month, 2)
+    mes_actual, mes_anterior, mes_anterior_2 = tables['meses']
     
     st.caption(f"Meses comparados: {mes_actual} (actual) vs {mes_anterior} (anterior) vs {mes_anterior_2} (hace 2 meses)")
     
-    df_mes_actual = df[df['fecha'].dt.month == mes_actual]
-    df_mes_ant1 = df[df['fecha'].dt.month == mes_anterior]
-    df_mes_ant2 = df[df['fecha'].dt.month == mes_anterior_2]
-    
-    clientes_m0 = df_mes_actual.groupby('cliente_nombre')['venta_neta'].sum().nlargest(20).reset_index()
-    clientes_m0.columns = ['Cliente', 'Mes Actual']
-    clientes_m1 = df_mes_ant1.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    clientes_m1.columns = ['Cliente', 'Mes Anterior']
-    clientes_m2 = df_mes_ant2.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    clientes_m2.columns = ['Cliente', 'Hace 2 Meses']
+    comp_clientes = tables['comp_clientes']
     
-    comp_clientes = clientes_m0.merge(clientes_m1, on='Cliente', how='left').merge(clientes_m2, on='Cliente', how='left').fillna(0)
-    comp_clientes['Cambio vs Anterior'] = comp_clientes['Mes Actual'] - comp_clientes['Mes Anterior']
-    comp_clientes['Cambio vs Hace 2'] = comp_clientes['Mes Actual'] - comp_clientes['Hace 2 Meses']
-    
-    st.dataframe(comp_clientes.round(2), hide_index=True, use_container_width=True)
+    st.dataframe(comp_clientes, hide_index=True, use_container_width=True)
     
     st.markdown("---")
     
     # --- 5. COMPARACIÓN MENSUAL DE PRODUCTOS (3 MESES) ---
     st.subheader("📦 Top Productos - Comparación 3 Meses")
     
-    prods_m0 = df_mes_actual.groupby('producto')['venta_neta'].sum().nlargest(20).reset_index()
-    prods_m0.columns = ['Producto', 'Mes Actual']
-    prods_m1 = df_mes_ant1.groupby('producto')['venta_neta'].sum().reset_index()
-    prods_m1.columns = ['Producto', 'Mes Anterior']
-    prods_m2 = df_mes_ant2.groupby('producto')['venta_neta'].sum().reset_index()
-    prods_m2.columns = ['Producto', 'Hace 2 Meses']
-    
-    comp_productos = prods_m0.merge(prods_m1, on='Producto', how='left').merge(prods_m2, on='Producto', how='left').fillna(0)
-    comp_productos['Cambio vs Anterior'] = comp_productos['Mes Actual'] - comp_productos['Mes Anterior']
-    comp_productos['Cambio vs Hace 2'] = comp_productos['Mes Actual'] - comp_productos['Hace 2 Meses']
+    comp_productos = tables['comp_productos']
     
-    st.dataframe(comp_productos.round(2), hide_index=True, use_container_width=True)
+    st.dataframe(comp_productos, hide_index=True, use_container_width=True)
     
     st.markdown("---")
     
@@ -1402,7 +1622,8 @@ def render_reminders():
     st.info("""
     **Endpoints disponibles en http://localhost:8502:**
     
-    - `POST /api/push-to-n8n` - Enviar todos los datos a n8n
+    - `POST /api/push-to-n8n` - Enviar todos los datos a n8n (en segundo plano)
+    - `GET /api/push-to-n8n/status/{job_id}` - Consultar el resultado de un envío
     - `GET /api/reminders` - Obtener todos los recordatorios
     - `GET /api/rfm-segments` - Obtener segmentación RFM
     
@@ -1413,62 +1634,63 @@ def render_reminders():
     """)
 
 
-def calculate_rfm_scores(dataframe):
-    """Calculate RFM scores for each customer."""
-    today = dataframe['fecha'].max()
-    
-    # Calculate RFM metrics per customer
-    rfm = dataframe.groupby('cliente_nombre').agg({
-        'fecha': 'max',           # Last purchase date (Recency)
-        'factura_id': 'nunique',  # Number of transactions (Frequency)
-        'venta_neta': 'sum'       # Total revenue (Monetary)
-    }).reset_index()
-    
-    rfm.columns = ['cliente', 'ultima_compra', 'frecuencia', 'valor_monetario']
-    rfm['recencia'] = (today - rfm['ultima_compra']).dt.days
+def calculate_rfm_scores(stats):
+    """Calculate RFM scores for each customer from its customer_stats() row."""
+    # RFM metrics per customer
+    rfm = pd.DataFrame({
+        'cliente': stats['cliente_nombre'],
+        'ultima_compra': stats['ultima_compra'],     # Last purchase date (Recency)
+        'frecuencia': stats['facturas'],             # Number of transactions (Frequency)
+        'valor_monetario': stats['venta_neta'],      # Total revenue (Monetary)
+        'recencia': stats['dias_sin_compra']
+    })
     
     # Assign scores 1-5 using quintiles (5 = best)
     # For recency: lower is better, so we invert
     rfm['R_score'] = pd.qcut(rfm['recencia'], 5, labels=[5, 4, 3, 2, 1], duplicates='drop').astype(int)
-    rfm['F_score'] = pd.qcut(rfm['frecuencia'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5], duplicates='drop').astype(int)
-    rfm['M_score'] = pd.qcut(rfm['valor_monetario'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5], duplicates='drop').astype(int)
+    rfm['F_score'] = rank_quintiles(rfm['frecuencia'])
+    rfm['M_score'] = rank_quintiles(rfm['valor_monetario'])
     
     # Combined RFM score
-    rfm['RFM_score'] = rfm['R_score'].astype(str) + rfm['F_score'].astype(str) + rfm['M_score'].astype(str)
+    rfm['RFM_score'] = (rfm['R_score'] * 100 + rfm['F_score'] * 10 + rfm['M_score']).astype(str)
     rfm['RFM_total'] = rfm['R_score'] + rfm['F_score'] + rfm['M_score']
     
-    # Assign segments based on RFM scores
-    def assign_segment(row):
-        r, f, m = row['R_score'], row['F_score'], row['M_score']
-        
-        if r >= 4 and f >= 4 and m >= 4:
-            return '🏆 VIP'
-        elif r >= 4 and f >= 4:
-            return '💎 Leal'
-        elif r >= 4 and m >= 4:
-            return '🌟 Potencial'
-        elif r <= 2 and f >= 3 and m >= 3:
-            return '⚠️ En Riesgo'
-        elif r <= 2 and m >= 3:
-            return '💤 Dormidos'
-        elif r <= 2:
-            return '👋 Perdidos'
-        elif r >= 4 and f <= 2:
-            return '🆕 Nuevos'
-        else:
-            return '📊 Regular'
-    
-    rfm['segmento'] = rfm.apply(assign_segment, axis=1)
+    # Assign segments based on RFM scores (first matching rule wins)
+    rfm['segmento'] = np.select(
+        rfm_segment_rules(rfm['R_score'], rfm['F_score'], rfm['M_score']),
+        ['🏆 VIP', '💎 Leal', '🌟 Potencial', '⚠️ En Riesgo', '💤 Dormidos', '👋 Perdidos', '🆕 Nuevos'],
+        default='📊 Regular'
+    )
     
     return rfm
 
 
+@st.cache_data(show_spinner=False)
+def rfm_scores(version):
+    """calculate_rfm_scores over the whole dataset, once per data version."""
+    return calculate_rfm_scores(customer_stats((version, None)))
+
+
+@st.cache_data(show_spinner=False)
+def rfm_segment_stats(version):
+    """Customers, value, mean frequency and mean recency per RFM segment, most valuable first."""
+    rfm = rfm_scores(version)
+    segment_stats = rfm.groupby('segmento').agg({
+        'cliente': 'count',
+        'valor_monetario': 'sum',
+        'frecuencia': 'mean',
+        'recencia': 'mean'
+    }).reset_index()
+    segment_stats.columns = ['Segmento', 'Clientes', 'Valor Total', 'Freq. Promedio', 'Recencia Promedio']
+    return segment_stats.sort_values('Valor Total', ascending=False)
+
+
 def render_rfm_segmentation():
     st.title("🎯 Segmentación RFM de Clientes")
     st.caption("Clasifica clientes según Recencia, Frecuencia y Valor Monetario")
     
     # Calculate RFM
-    rfm = calculate_rfm_scores(df)
+    rfm = rfm_scores(DATA_VERSION)
     
     # Explanation
     with st.expander("📖 ¿Qué significa cada segmento? (click para ver ejemplos)", expanded=False):
@@ -1547,14 +1769,7 @@ def render_rfm_segmentation():
     st.markdown("---")
     
     # --- KEY METRICS ---
-    segment_stats = rfm.groupby('segmento').agg({
-        'cliente': 'count',
-        'valor_monetario': 'sum',
-        'frecuencia': 'mean',
-        'recencia': 'mean'
-    }).reset_index()
-    segment_stats.columns = ['Segmento', 'Clientes', 'Valor Total', 'Freq. Promedio', 'Recencia Promedio']
-    segment_stats = segment_stats.sort_values('Valor Total', ascending=False)
+    segment_stats = rfm_segment_stats(DATA_VERSION)
     
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("Total Clientes", len(rfm))
@@ -1582,7 +1797,8 @@ def render_rfm_segmentation():
             '📊 Regular': '#4169E1'
         }
         
-        fig_pie = px.pie(
+        fig_pie = cached_figure(
+            'pie',
             segment_stats,
             values='Clientes',
             names='Segmento',
@@ -1597,7 +1813,8 @@ def render_rfm_segmentation():
     with col_right:
         st.subheader("💰 Valor por Segmento")
         
-        fig_bar = px.bar(
+        fig_bar = cached_figure(
+            'bar',
             segment_stats,
             x='Segmento',
             y='Valor Total',
@@ -1614,8 +1831,9 @@ def render_rfm_segmentation():
     # --- SCATTER PLOT ---
     st.subheader("🔍 Mapa de Clientes (Recencia vs Valor)")
     
-    fig_scatter = px.scatter(
-        rfm,
+    fig_scatter = cached_figure(
+        'scatter',
+        plot_frame(rfm, ['recencia', 'valor_monetario', 'segmento', 'frecuencia', 'cliente']),
         x='recencia',
         y='valor_monetario',
         color='segmento',
@@ -1638,11 +1856,27 @@ def render_rfm_segmentation():
     # --- DETAILED TABLE ---
     st.subheader("📋 Detalle por Cliente")
     
+    rfm_customer_table(rfm)
+    
+    # Summary stats
+    st.markdown("---")
+    st.subheader("📈 Resumen por Segmento")
+    summary_display = segment_stats.copy()
+    summary_display['Valor Total'] = summary_display['Valor Total'].apply(lambda x: f"${x:,.0f}")
+    summary_display['Freq. Promedio'] = summary_display['Freq. Promedio'].apply(lambda x: f"{x:.1f}")
+    summary_display['Recencia Promedio'] = summary_display['Recencia Promedio'].apply(lambda x: f"{x:.0f} días")
+    st.dataframe(summary_display, hide_index=True, use_container_width=True)
+
+
+@st.fragment
+def rfm_customer_table(rfm):
+    """Per-customer RFM table with its segment filter and sort. A fragment: the widgets rerun only the table."""
     # Segment filter
+    segments = rfm['segmento'].unique()
     selected_segments = st.multiselect(
         "Filtrar por segmento:",
-        options=rfm['segmento'].unique(),
-        default=rfm['segmento'].unique()
+        options=segments,
+        default=segments
     )
     
     filtered_rfm = rfm[rfm['segmento'].isin(selected_segments)]
@@ -1659,19 +1893,10 @@ def render_rfm_segmentation():
     # Display table
     display_df = sorted_rfm[['cliente', 'segmento', 'recencia', 'frecuencia', 'valor_monetario', 'R_score', 'F_score', 'M_score', 'RFM_score']].copy()
     display_df.columns = ['Cliente', 'Segmento', 'Días Sin Comprar', 'Transacciones', 'Valor Total', 'R', 'F', 'M', 'Score']
-    display_df['Valor Total'] = display_df['Valor Total'].apply(lambda x: f"${x:,.2f}")
-    
-    st.dataframe(display_df.head(50), hide_index=True, use_container_width=True)
+    display_df = display_df.head(50)  # format only the rows shown
+    display_df['Valor Total'] = display_df['Valor Total'].map('${:,.2f}'.format)
     
-    # Summary stats
-    st.markdown("---")
-    st.subheader("📈 Resumen por Segmento")
-    summary_display = segment_stats.copy()
-    summary_display['Valor Total'] = summary_display['Valor Total'].apply(lambda x: f"${x:,.0f}")
-    summary_display['Freq. Promedio'] = summary_display['Freq. Promedio'].apply(lambda x: f"{x:.1f}")
-    summary_display['Recencia Promedio'] = summary_display['Recencia Promedio'].apply(lambda x: f"{x:.0f} días")
-    st.dataframe(summary_display, hide_index=True, use_container_width=True)
-
+    st.dataframe(display_df, hide_index=True, use_container_width=True)
 
 
 def render_config():
@@ -1685,12 +1910,16 @@ def render_config():
     if uploaded_file is not None:
         if st.button("Confirmar y Actualizar"):
             try:
-                # Save file
-                with open(DATA_PATH, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                # Save file (temp file + rename, a failed upload keeps the old CSV)
+                save_data_file(uploaded_file, DATA_PATH)
                 
                 # Clear cache
                 st.cache_data.clear()
+                st.cache_resource.clear()
+                
+                # Parse now so the Parquet sidecar is written before the rerun (and for the API)
+                with st.spinner("Procesando archivo..."):
+                    shared_data(DATA_PATH, data_version(DATA_PATH))
                 
                 st.success("✅ Archivo actualizado correctamente. La caché ha sido limpiada.")
                 st.rerun()
@@ -1701,6 +1930,7 @@ def render_config():
     st.markdown("### 🗑️ Mantenimiento")
     if st.button("Limpiar Caché Manualmente"):
         st.cache_data.clear()
+        st.cache_resource.clear()
         st.success("Caché limpiada.")
         st.rerun()
 
@@ -1719,20 +1949,18 @@ def render_client_search(search_term):
         
         # Show all clients as a list
         st.subheader("📋 Lista de Clientes")
-        all_clients = df.groupby('cliente_nombre').agg({
-            'venta_neta': 'sum',
-            'fecha': ['max', 'count']
-        }).reset_index()
+        all_clients = customer_stats((DATA_VERSION, None))[['cliente_nombre', 'venta_neta', 'ultima_compra', 'transacciones']]
         all_clients.columns = ['Cliente', 'Ventas Totales', 'Última Compra', 'Transacciones']
-        all_clients = all_clients.sort_values('Ventas Totales', ascending=False)
+        # Format only the 50 rows shown
+        all_clients = all_clients.nlargest(50, 'Ventas Totales')
         all_clients['Ventas Totales'] = all_clients['Ventas Totales'].apply(lambda x: f"${x:,.2f}")
         all_clients['Última Compra'] = all_clients['Última Compra'].dt.strftime('%d/%m/%Y')
-        st.dataframe(all_clients.head(50), hide_index=True, use_container_width=True)
+        st.dataframe(all_clients, hide_index=True, use_container_width=True)
         return
     
     # Search for matching clients
-    matching = df[df['cliente_nombre'].str.lower().str.contains(search_term.lower(), na=False)]
-    unique_matches = matching['cliente_nombre'].unique()
+    matching = df['cliente_nombre'][contains_mask(df['cliente_nombre'], search_term.lower())]
+    unique_matches = matching.unique()
     
     if len(unique_matches) == 0:
         st.warning(f"No se encontraron clientes con '{search_term}'")
@@ -1748,7 +1976,7 @@ def render_client_search(search_term):
     
     # Show client details
     client_df = df[df['cliente_nombre'] == selected_client]
-    today = df['fecha'].max()
+    today = max_date
     
     st.subheader(f"📊 {selected_client}")
     
@@ -1763,11 +1991,11 @@ def render_client_search(search_term):
     
     # Products bought
     st.subheader("📦 Productos Comprados")
-    products = client_df.groupby('producto').agg({
+    products = client_df.groupby('producto', observed=True).agg({
         'cantidad': 'sum',
         'venta_neta': 'sum',
         'fecha': 'max'
-    }).reset_index().sort_values('venta_neta', ascending=False)
+    }).reset_index().nlargest(20, 'venta_neta')  # only the top 20 are shown
     products.columns = ['Producto', 'Cantidad', 'Valor', 'Última Compra']
     
     fig = px.bar(products.head(15), x='Valor', y='Producto', orientation='h', template='plotly_dark', color='Valor')
@@ -1786,22 +2014,17 @@ def render_product_search(search_term):
         
         # Show all products as a list
         st.subheader("📋 Lista de Productos")
-        all_products = df.groupby('producto').agg({
-            'venta_neta': 'sum',
-            'cantidad': 'sum',
-            'cliente_nombre': 'nunique',
-            'fecha': 'max'
-        }).reset_index()
+        all_products = product_stats(DATA_VERSION)[['producto', 'venta_neta', 'cantidad', 'clientes', 'ultima_venta']]
         all_products.columns = ['Producto', 'Ventas Totales', 'Unidades', 'Clientes', 'Última Venta']
-        all_products = all_products.sort_values('Ventas Totales', ascending=False)
+        all_products = all_products.nlargest(50, 'Ventas Totales')
         all_products['Ventas Totales'] = all_products['Ventas Totales'].apply(lambda x: f"${x:,.2f}")
         all_products['Última Venta'] = all_products['Última Venta'].dt.strftime('%d/%m/%Y')
-        st.dataframe(all_products.head(50), hide_index=True, use_container_width=True)
+        st.dataframe(all_products, hide_index=True, use_container_width=True)
         return
     
     # Search for matching products
-    matching = df[df['producto'].str.lower().str.contains(search_term.lower(), na=False)]
-    unique_matches = matching['producto'].unique()
+    matching = df['producto'][contains_mask(df['producto'], search_term.lower())]
+    unique_matches = matching.unique()
     
     if len(unique_matches) == 0:
         st.warning(f"No se encontraron productos con '{search_term}'")
@@ -1817,7 +2040,7 @@ def render_product_search(search_term):
     
     # Show product details
     product_df = df[df['producto'] == selected_product]
-    today = df['fecha'].max()
+    today = max_date
     
     st.subheader(f"📦 {selected_product}")
     
@@ -1851,13 +2074,11 @@ def render_product_search(search_term):
     
     # Top customers for this product
     st.subheader("🏆 Top Clientes que Compran este Producto")
-    customers = product_df.groupby('cliente_nombre').agg({
-        'cantidad': 'sum',
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count']
-    }).reset_index()
+    # Same cached per-(product, customer) stats as the recency view
+    customers = customers_of(customer_stats((DATA_VERSION, None), 'producto'), 'producto', selected_product)
+    customers = customers[['cliente_nombre', 'cantidad', 'venta_neta', 'ultima_compra', 'transacciones']]
     customers.columns = ['Cliente', 'Unidades', 'Total Comprado', 'Última Compra', 'Transacciones']
-    customers = customers.sort_values('Total Comprado', ascending=False)
+    customers = customers.nlargest(30, 'Total Comprado')  # only the top 30 are shown
     
     # Chart
     fig = px.bar(customers.head(15), x='Total Comprado', y='Cliente', orientation='h', 
@@ -1866,22 +2087,18 @@ def render_product_search(search_term):
     fig.update_layout(yaxis={'categoryorder': 'total ascending'}, title='Top 15 Clientes por Valor')
     st.plotly_chart(fig, use_container_width=True)
     
-    # Table with all customers
-    customers_display = customers.copy()
+    # Table with the top customers (format only the rows shown)
+    customers_display = customers.head(30).copy()
     customers_display['Total Comprado'] = customers_display['Total Comprado'].apply(lambda x: f"${x:,.2f}")
     customers_display['Última Compra'] = customers_display['Última Compra'].dt.strftime('%d/%m/%Y')
-    st.dataframe(customers_display.head(30), hide_index=True, use_container_width=True)
+    st.dataframe(customers_display, hide_index=True, use_container_width=True)
     export_dataframe(customers, f"clientes_producto_{selected_product[:20]}", "product_customers")
     
     st.markdown("---")
     
     # Sales trend for this product
     st.subheader("📈 Tendencia de Ventas del Producto")
-    monthly_sales = product_df.groupby(product_df['fecha'].dt.to_period('M')).agg({
-        'venta_neta': 'sum',
-        'cantidad': 'sum'
-    }).reset_index()
-    monthly_sales['fecha'] = monthly_sales['fecha'].dt.to_timestamp()
+    monthly_sales = product_df.groupby(product_df['month_year'].rename('fecha'))[['venta_neta', 'cantidad']].sum().reset_index()
     
     fig = px.line(monthly_sales, x='fecha', y='venta_neta', markers=True, 
                   template='plotly_dark', title='Ventas Mensuales',
@@ -1894,18 +2111,9 @@ def render_inactive_clients():
     st.title("⏰ Clientes Inactivos")
     st.caption("Clientes importantes que no han comprado en más de 90 días")
     
-    today = df['fecha'].max()
-    
-    cust_stats = df.groupby('cliente_nombre').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count']
-    }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'ultima_compra', 'transacciones']
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
-    
-    # Filter important inactive
-    important = cust_stats[(cust_stats['transacciones'] > 3) | (cust_stats['total_ventas'] > 5000)]
-    inactive = important[important['dias_sin_compra'] > 90].sort_values('total_ventas', ascending=False)
+    # Same important-inactive selection as the reminders view
+    tables = reminder_tables(DATA_VERSION)
+    inactive = tables['inactive']
     
     col1, col2, col3 = st.columns(3)
     col1.metric("Clientes Inactivos", len(inactive))
@@ -1915,18 +2123,15 @@ def render_inactive_clients():
     st.markdown("---")
     
     if not inactive.empty:
-        fig = px.scatter(inactive, x='dias_sin_compra', y='total_ventas', 
+        fig = px.scatter(plot_frame(inactive, ['dias_sin_compra', 'total_ventas', 'cliente', 'transacciones']),
+                        x='dias_sin_compra', y='total_ventas',
                         hover_name='cliente', size='transacciones',
                         title='Clientes Inactivos: Días vs Valor',
                         template='plotly_dark', color='dias_sin_compra',
                         color_continuous_scale='Reds')
         st.plotly_chart(fig, use_container_width=True)
         
-        inactive_display = inactive.copy()
-        inactive_display['ultima_compra'] = inactive_display['ultima_compra'].dt.strftime('%d/%m/%Y')
-        inactive_display['total_ventas'] = inactive_display['total_ventas'].apply(lambda x: f"${x:,.2f}")
-        inactive_display.columns = ['Cliente', 'Ventas Totales', 'Última Compra', 'Transacciones', 'Días Inactivo']
-        st.dataframe(inactive_display, hide_index=True, use_container_width=True)
+        st.dataframe(tables['inactive_display'], hide_index=True, use_container_width=True)
     else:
         st.success("✅ No hay clientes importantes inactivos")
 
@@ -1935,17 +2140,12 @@ def render_top_products():
     """Show top performing products."""
     st.title("🏆 Top Productos")
     
-    prod_stats = filtered_df.groupby('producto').agg({
-        'venta_neta': 'sum',
-        'cantidad': 'sum',
-        'cliente_nombre': 'nunique',
-        'fecha': ['max', 'count']
-    }).reset_index()
-    prod_stats.columns = ['Producto', 'Ventas', 'Cantidad', 'Clientes', 'Última Venta', 'Transacciones']
-    prod_stats = prod_stats.sort_values('Ventas', ascending=False)
+    top_stats = top_product_stats(FILTER_KEY)
+    total_products = top_stats['total']
+    prod_stats = top_stats['top']  # only the top 30 are shown
     
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Productos", len(prod_stats))
+    col1.metric("Total Productos", total_products)
     col2.metric("Top Producto", prod_stats.iloc[0]['Producto'][:20] + "...")
     col3.metric("Ventas #1", f"${prod_stats.iloc[0]['Ventas']:,.0f}")
     
@@ -1965,18 +2165,9 @@ def render_stale_products():
     st.title("📉 Productos Sin Movimiento")
     st.caption("Productos importantes que no se han vendido en más de 60 días")
     
-    today = df['fecha'].max()
-    
-    prod_stats = df.groupby('producto').agg({
-        'venta_neta': 'sum',
-        'fecha': ['max', 'count']
-    }).reset_index()
-    prod_stats.columns = ['producto', 'total_ventas', 'ultima_venta', 'transacciones']
-    prod_stats['dias_sin_venta'] = (today - prod_stats['ultima_venta']).dt.days
-    
-    # Top 50 products by sales that are stale
-    top_products = prod_stats.nlargest(50, 'total_ventas')
-    stale = top_products[top_products['dias_sin_venta'] > 60].sort_values('total_ventas', ascending=False)
+    # Top 50 products by sales that are stale (same tables as the reminders view)
+    tables = reminder_tables(DATA_VERSION)
+    stale = tables['stale']
     
     col1, col2 = st.columns(2)
     col1.metric("Productos Afectados", len(stale))
@@ -1992,10 +2183,7 @@ def render_stale_products():
         fig.update_layout(yaxis={'categoryorder': 'total ascending'})
         st.plotly_chart(fig, use_container_width=True)
         
-        stale_display = stale.copy()
-        stale_display['ultima_venta'] = stale_display['ultima_venta'].dt.strftime('%d/%m/%Y')
-        stale_display['total_ventas'] = stale_display['total_ventas'].apply(lambda x: f"${x:,.2f}")
-        st.dataframe(stale_display, hide_index=True, use_container_width=True)
+        st.dataframe(tables['stale_display'], hide_index=True, use_container_width=True)
     else:
         st.success("✅ Todos los productos top tienen ventas recientes")
 
@@ -2009,10 +2197,7 @@ def render_ml_predictions():
     model_type = st.radio("Seleccionar modelo:", ["🚀 Prophet (Recomendado)", "📈 Regresión Lineal (Simple)"], horizontal=True)
     
     # Prepare monthly data
-    monthly = df.groupby(df['fecha'].dt.to_period('M')).agg({
-        'venta_neta': 'sum'
-    }).reset_index()
-    monthly['fecha'] = monthly['fecha'].dt.to_timestamp()
+    monthly = df.groupby(df['month_year'].rename('fecha'))['venta_neta'].sum().reset_index()
     
     if len(monthly) < 3:
         st.warning("Se necesitan al menos 3 meses de datos para hacer predicciones")
@@ -2179,21 +2364,22 @@ def render_churn_prediction():
         st.error("⚠️ scikit-learn no está instalado")
         return
     
-    today = df['fecha'].max()
+    today = max_date
     
     # Build customer features
-    cust_stats = df.groupby('cliente_nombre').agg({
-        'venta_neta': ['sum', 'mean', 'std'],
-        'fecha': ['max', 'min', 'count'],
-        'cantidad': 'sum',
-        'producto': 'nunique'
-    }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'venta_promedio', 'venta_std', 
-                          'ultima_compra', 'primera_compra', 'transacciones', 
-                          'cantidad', 'productos_unicos']
-    
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
-    cust_stats['dias_como_cliente'] = (cust_stats['ultima_compra'] - cust_stats['primera_compra']).dt.days
+    cust_stats = df.groupby('cliente_nombre', observed=True).agg(
+        total_ventas=('venta_neta', 'sum'),
+        venta_promedio=('venta_neta', 'mean'),
+        venta_std=('venta_neta', 'std'),
+        ultima_compra=('fecha', 'max'),
+        primera_compra=('fecha', 'min'),
+        transacciones=('fecha', 'count'),
+        cantidad=('cantidad', 'sum'),
+        productos_unicos=('producto', 'nunique')
+    ).rename_axis('cliente').reset_index()
+    
+    cust_stats['dias_sin_compra'] = days_since(today, cust_stats['ultima_compra'])
+    cust_stats['dias_como_cliente'] = days_between(cust_stats['primera_compra'], cust_stats['ultima_compra'])
     cust_stats['frecuencia'] = cust_stats['transacciones'] / (cust_stats['dias_como_cliente'] + 1) * 30
     cust_stats['venta_std'] = cust_stats['venta_std'].fillna(0)
     
@@ -2278,7 +2464,7 @@ def render_churn_prediction():
     
     with col_right:
         st.subheader("💰 Valor por Nivel de Riesgo")
-        risk_value = cust_stats.groupby('riesgo')['total_ventas'].sum().reset_index()
+        risk_value = cust_stats.groupby('riesgo', observed=True)['total_ventas'].sum().reset_index()
         fig = px.bar(risk_value, x='riesgo', y='total_ventas', template='plotly_dark',
                      color='riesgo', color_discrete_map={'🟢 Bajo': '#00cc96', '🟡 Medio': '#ffa500', '🔴 Alto': '#ef553b'})
         st.plotly_chart(fig, use_container_width=True)
@@ -2309,9 +2495,9 @@ def render_churn_prediction():
     )
     
     if risk_filter == "Todos":
-        filtered_customers = cust_stats.copy()
+        filtered_customers = cust_stats
     else:
-        filtered_customers = cust_stats[cust_stats['riesgo'] == risk_filter].copy()
+        filtered_customers = cust_stats[cust_stats['riesgo'] == risk_filter]
     
     st.subheader(f"📋 Clientes ({risk_filter}) - {len(filtered_customers)} encontrados")
     display_df = filtered_customers.nlargest(50, 'total_ventas')[['cliente', 'total_ventas', 'transacciones', 'dias_sin_compra', 'prob_churn', 'riesgo']].copy()
@@ -2329,7 +2515,7 @@ def render_product_associations():
     st.caption("Análisis de asociación para cross-selling")
     
     # Group by invoice to find co-purchases
-    invoice_products = df.groupby('factura_id')['producto'].apply(list).reset_index()
+    invoice_products = df.groupby('factura_id', observed=True)['producto'].apply(list).reset_index()
     
     # Count co-occurrences
     from collections import defaultdict
@@ -2387,16 +2573,17 @@ def render_product_associations():
     
     # Product selector for recommendations
     st.subheader("🎯 Buscar Recomendaciones")
-    all_products = sorted(df['producto'].unique())
+    all_products = sorted_options(DATA_VERSION, 'producto')
     selected_product = st.selectbox("Selecciona un producto:", all_products, key="assoc_product")
     
     if selected_product:
         # Find top associated products
-        associated = pairs_df[(pairs_df['producto_1'] == selected_product) | (pairs_df['producto_2'] == selected_product)].copy()
+        associated = pairs_df[(pairs_df['producto_1'] == selected_product) | (pairs_df['producto_2'] == selected_product)]
         if not associated.empty:
-            associated['otro_producto'] = associated.apply(
-                lambda x: x['producto_2'] if x['producto_1'] == selected_product else x['producto_1'], axis=1)
+            # Top 10 first, then pick the other product of each pair (no row-wise apply)
             associated = associated.nlargest(10, 'veces_juntos')
+            associated['otro_producto'] = np.where(
+                associated['producto_1'] == selected_product, associated['producto_2'], associated['producto_1'])
             
             st.success(f"**Clientes que compran '{selected_product[:30]}...' también compran:**")
             for _, row in associated.iterrows():
@@ -2417,8 +2604,8 @@ def render_product_demand():
         st.error("⚠️ scikit-learn no está instalado")
         return
     
-    # Get top products
-    top_products = df.groupby('producto')['venta_neta'].sum().nlargest(20).index.tolist()
+    # Get top products (from the cached per-product totals)
+    top_products = product_stats(DATA_VERSION).nlargest(20, 'venta_neta')['producto'].tolist()
     
     selected_product = st.selectbox("Selecciona un producto:", top_products)
     
@@ -2426,11 +2613,8 @@ def render_product_demand():
         prod_df = df[df['producto'] == selected_product]
         
         # Monthly sales for this product
-        monthly = prod_df.groupby(prod_df['fecha'].dt.to_period('M')).agg({
-            'venta_neta': 'sum',
-            'cantidad': 'sum'
-        }).reset_index()
-        monthly['fecha'] = monthly['fecha'].astype(str)
+        monthly = prod_df.groupby(prod_df['month_year'].rename('fecha'))[['venta_neta', 'cantidad']].sum().reset_index()
+        monthly['fecha'] = monthly['fecha'].dt.strftime('%Y-%m')
         monthly['month_num'] = range(1, len(monthly) + 1)
         
         if len(monthly) < 3:
@@ -2484,19 +2668,21 @@ def render_clv_prediction():
     st.title("💰 Valor de Vida del Cliente (CLV)")
     st.caption("Estimación del valor futuro de cada cliente")
     
-    today = df['fecha'].max()
-    
-    # Calculate customer metrics
-    cust_stats = df.groupby('cliente_nombre').agg({
-        'venta_neta': ['sum', 'mean'],
-        'fecha': ['max', 'min', 'count']
-    }).reset_index()
-    cust_stats.columns = ['cliente', 'total_ventas', 'venta_promedio', 'ultima_compra', 'primera_compra', 'transacciones']
+    # Customer metrics from the shared cached per-customer stats
+    stats = customer_stats((DATA_VERSION, None))
+    cust_stats = pd.DataFrame({
+        'cliente': stats['cliente_nombre'],
+        'total_ventas': stats['venta_neta'],
+        'venta_promedio': stats['venta_neta'] / stats['transacciones'],
+        'ultima_compra': stats['ultima_compra'],
+        'primera_compra': stats['primera_compra'],
+        'transacciones': stats['transacciones'],
+        'dias_sin_compra': stats['dias_sin_compra']
+    })
     
     # Calculate CLV components
-    cust_stats['dias_como_cliente'] = (cust_stats['ultima_compra'] - cust_stats['primera_compra']).dt.days + 1
+    cust_stats['dias_como_cliente'] = days_between(cust_stats['primera_compra'], cust_stats['ultima_compra']) + 1
     cust_stats['frecuencia_mensual'] = cust_stats['transacciones'] / (cust_stats['dias_como_cliente'] / 30)
-    cust_stats['dias_sin_compra'] = (today - cust_stats['ultima_compra']).dt.days
     
     # Simple CLV: Average order value × Purchase frequency × Expected lifespan
     # Assuming 2 year expected lifespan for active customers
@@ -2530,7 +2716,7 @@ def render_clv_prediction():
     
     with col_right:
         st.subheader("🏆 Valor por Segmento")
-        seg_stats = cust_stats.groupby('segmento_valor').agg({
+        seg_stats = cust_stats.groupby('segmento_valor', observed=True).agg({
             'cliente': 'count',
             'clv_estimado': 'sum'
         }).reset_index()
@@ -2549,9 +2735,9 @@ def render_clv_prediction():
     )
     
     if segment_filter == "Todos":
-        filtered_clv = cust_stats.copy()
+        filtered_clv = cust_stats
     else:
-        filtered_clv = cust_stats[cust_stats['segmento_valor'] == segment_filter].copy()
+        filtered_clv = cust_stats[cust_stats['segmento_valor'] == segment_filter]
     
     st.subheader(f"📋 Clientes ({segment_filter}) - {len(filtered_clv)} encontrados")
     display_clv = filtered_clv.nlargest(50, 'clv_estimado')[['cliente', 'total_ventas', 'transacciones', 'frecuencia_mensual', 'clv_estimado', 'segmento_valor', 'dias_sin_compra']].copy()
@@ -2564,25 +2750,42 @@ def render_clv_prediction():
     export_dataframe(export_clv, f"clientes_clv_{segment_filter.replace(' ', '_')}", "clv_export")
 
 
+# pandas' day_name() labels (English, locale-independent), indexed by dt.dayofweek
+DAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+
+
+@st.cache_data(show_spinner=False)
+def seasonality_tables(version):
+    """Sales by month, weekday and week of month over the whole dataset, once per data version."""
+    fechas = df['fecha']
+    
+    monthly = df.groupby([df['num_mes'].rename('mes'), 'nombre_mes'], observed=True)['venta_neta'].sum().reset_index()
+    monthly = monthly.sort_values('mes')
+    avg = monthly['venta_neta'].mean()
+    v = monthly['venta_neta'].to_numpy()
+    monthly['status'] = np.select([v > avg * 1.1, v < avg * 0.9], ['Alto', 'Bajo'], default='Normal')
+    
+    # Group on the weekday number; names are attached to the 7 rows instead of built per sale
+    daily = df.groupby(fechas.dt.dayofweek.rename('dia_semana'))['venta_neta'].sum().reset_index()
+    daily.insert(1, 'nombre_dia', DAY_NAMES[daily['dia_semana'].to_numpy()])
+    
+    weekly = df.groupby(((fechas.dt.day - 1) // 7 + 1).rename('semana_mes'))['venta_neta'].sum().reset_index()
+    weekly['semana_mes'] = weekly['semana_mes'].apply(lambda x: f"Semana {x}")
+    
+    return {'monthly': monthly, 'daily': daily, 'weekly': weekly}
+
+
 def render_seasonality():
     """Analyze sales seasonality patterns."""
     st.title("🗓️ Análisis de Estacionalidad")
     st.caption("Patrones de ventas por mes, día de la semana y hora")
     
-    df_season = df.copy()
-    df_season['mes'] = df_season['fecha'].dt.month
-    df_season['nombre_mes'] = df_season['fecha'].dt.month_name()
-    df_season['dia_semana'] = df_season['fecha'].dt.dayofweek
-    df_season['nombre_dia'] = df_season['fecha'].dt.day_name()
-    df_season['semana_mes'] = (df_season['fecha'].dt.day - 1) // 7 + 1
+    tables = seasonality_tables(DATA_VERSION)
     
     # Monthly pattern
     st.subheader("📅 Patrón Mensual")
-    monthly = df_season.groupby(['mes', 'nombre_mes'])['venta_neta'].sum().reset_index()
-    monthly = monthly.sort_values('mes')
+    monthly = tables['monthly']
     avg = monthly['venta_neta'].mean()
-    monthly['status'] = monthly['venta_neta'].apply(
-        lambda x: 'Alto' if x > avg * 1.1 else ('Bajo' if x < avg * 0.9 else 'Normal'))
     
     # Best/worst months
     best_month = monthly.loc[monthly['venta_neta'].idxmax(), 'nombre_mes']
@@ -2606,15 +2809,13 @@ def render_seasonality():
     
     with col_left:
         st.subheader("📆 Patrón por Día de Semana")
-        daily = df_season.groupby(['dia_semana', 'nombre_dia'])['venta_neta'].sum().reset_index()
-        daily = daily.sort_values('dia_semana')
+        daily = tables['daily']
         fig = px.bar(daily, x='nombre_dia', y='venta_neta', template='plotly_dark', color='venta_neta')
         st.plotly_chart(fig, use_container_width=True)
     
     with col_right:
         st.subheader("📈 Semana del Mes")
-        weekly = df_season.groupby('semana_mes')['venta_neta'].sum().reset_index()
-        weekly['semana_mes'] = weekly['semana_mes'].apply(lambda x: f"Semana {x}")
+        weekly = tables['weekly']
         fig = px.bar(weekly, x='semana_mes', y='venta_neta', template='plotly_dark', color='venta_neta')
         st.plotly_chart(fig, use_container_width=True)
     
@@ -2639,38 +2840,27 @@ def render_next_purchase():
     st.title("⏰ Predicción de Próxima Compra")
     st.caption("Estima cuándo volverá a comprar cada cliente")
     
-    today = df['fecha'].max()
-    
-    # Calculate purchase intervals per customer
-    def calc_avg_interval(group):
-        if len(group) < 2:
-            return None
-        dates = group['fecha'].sort_values()
-        intervals = dates.diff().dt.days.dropna()
-        return intervals.mean() if len(intervals) > 0 else None
+    today = max_date
     
-    cust_intervals = df.groupby('cliente_nombre').apply(calc_avg_interval).reset_index()
-    cust_intervals.columns = ['cliente', 'intervalo_promedio']
+    # Per-customer first/last purchase, purchases and sales in one cached groupby (no merges)
+    cust_pred = customer_stats((DATA_VERSION, None))
+    cust_pred = cust_pred[cust_pred['transacciones'] >= 2]
     
-    # Get last purchase date
-    last_purchase = df.groupby('cliente_nombre')['fecha'].max().reset_index()
-    last_purchase.columns = ['cliente', 'ultima_compra']
-    
-    # Merge
-    cust_pred = cust_intervals.merge(last_purchase, on='cliente')
-    cust_pred = cust_pred.dropna()
+    # Mean gap between consecutive purchases: the diffs telescope to (last - first) / (n - 1)
+    span_days = days_between(cust_pred['primera_compra'], cust_pred['ultima_compra'])
+    cust_pred = pd.DataFrame({
+        'cliente': cust_pred['cliente_nombre'],
+        'intervalo_promedio': span_days / (cust_pred['transacciones'] - 1),
+        'ultima_compra': cust_pred['ultima_compra'],
+        'total_ventas': cust_pred['venta_neta']
+    }).reset_index(drop=True)
     
     # Calculate expected next purchase
-    cust_pred['dias_desde_ultima'] = (today - cust_pred['ultima_compra']).dt.days
+    cust_pred['dias_desde_ultima'] = days_since(today, cust_pred['ultima_compra'])
     cust_pred['dias_hasta_proxima'] = cust_pred['intervalo_promedio'] - cust_pred['dias_desde_ultima']
     cust_pred['fecha_esperada'] = cust_pred['ultima_compra'] + pd.to_timedelta(cust_pred['intervalo_promedio'], unit='D')
-    cust_pred['estado'] = cust_pred['dias_hasta_proxima'].apply(
-        lambda x: '🔴 Atrasado' if x < -7 else ('🟡 Próximo' if x < 7 else '🟢 A tiempo'))
-    
-    # Add total sales
-    cust_sales = df.groupby('cliente_nombre')['venta_neta'].sum().reset_index()
-    cust_sales.columns = ['cliente', 'total_ventas']
-    cust_pred = cust_pred.merge(cust_sales, on='cliente')
+    d = cust_pred['dias_hasta_proxima'].to_numpy()
+    cust_pred['estado'] = np.select([d < -7, d < 7], ['🔴 Atrasado', '🟡 Próximo'], default='🟢 A tiempo')
     
     # Filter to active customers (max 180 days since last purchase, interval < 180 days)
     active = cust_pred[
@@ -1,16 +1,120 @@
+import os
+import shutil
+import numpy as np
 import pandas as pd
 import streamlit as st
 import re
 from thefuzz import process, fuzz
 from product_catalog import CANONICAL_PRODUCTS
 
-@st.cache_data
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+def data_version(file_path):
+    """(mtime_ns, size) of the data file, or None if it does not exist."""
+    try:
+        stat = os.stat(file_path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+# Group-by keys stored as pandas Categorical (group on them with observed=True),
+# plus the other low-cardinality text columns, which would otherwise hold one string object per row
+CATEGORICAL_COLS = ('producto', 'cliente_nombre', 'categoria', 'factura_id',
+                    'sku', 'producto_normalizado', 'producto_original')
+
+
+# Bump when load_data's output columns/dtypes change so old sidecars are ignored
+PARQUET_CACHE_VERSION = 7
+
+
+def parquet_cache_path(file_path):
+    """Path of the Parquet copy of the processed CSV."""
+    return f"{file_path}.v{PARQUET_CACHE_VERSION}.parquet"
+
+
+# Schema metadata key holding the (mtime_ns, size) of the CSV a sidecar was built from
+SOURCE_VERSION_KEY = b"dashboard_source_version"
+
+
+def encode_version(version):
+    """data_version() tuple as the bytes stored in the sidecar's metadata."""
+    return "{},{}".format(*version).encode()
+
+
+def read_parquet_cache(file_path):
+    """
+    The processed dataframe from the Parquet sidecar if it was built from the CSV as it is now, else None.
+    Exact (mtime_ns, size) match, so a CSV swapped in with an older or preserved mtime is re-parsed.
+    """
+    cache_path = parquet_cache_path(file_path)
+    try:
+        version = data_version(file_path)
+        metadata = pq.read_schema(cache_path).metadata or {}
+        if version is not None and metadata.get(SOURCE_VERSION_KEY) == encode_version(version):
+            df = pd.read_parquet(cache_path, engine='pyarrow')
+            # Arrow gives integer-valued categoricals (factura_id) back as plain ints
+            for col in CATEGORICAL_COLS:
+                if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                    df[col] = df[col].astype('category')
+            return df
+    except Exception:
+        pass  # Missing or unreadable sidecar, parse the CSV
+    return None
+
+
+def write_parquet_cache(df, file_path, source_version):
+    """
+    Persist the processed dataframe next to the CSV (best-effort, the CSV stays the source of truth),
+    stamped with the data_version() of the CSV it was parsed from.
+    """
+    if source_version is None:
+        return
+    cache_path = parquet_cache_path(file_path)
+    try:
+        table = pa.Table.from_pandas(df)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_VERSION_KEY: encode_version(source_version)})
+        # Write then rename so a concurrent reader never sees a half-written file
+        tmp_path = cache_path + ".tmp"
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        pass
+
+
+def save_data_file(src, file_path, chunk_size=4 * 1024 * 1024):
+    """Stream an uploaded file-like object to `file_path` through a temp file, so readers never see a partial CSV."""
+    tmp_path = file_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as out:
+            shutil.copyfileobj(src, out, length=chunk_size)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def load_data(file_path):
     """
-    Loads sales data from a CSV file.
+    Loads sales data from a CSV file, or from its Parquet sidecar when that is up to date.
+    Not memoized here: the app (shared_data) and the API (get_df) each keep the one copy they use.
     """
+    if PYARROW_AVAILABLE:
+        cached = read_parquet_cache(file_path)
+        if cached is not None:
+            return cached
+    
     try:
-        df = pd.read_csv(file_path, encoding='utf-8-sig')
+        # Taken before parsing, so a CSV replaced mid-read can't stamp the sidecar with its newer version
+        source_version = data_version(file_path)
+        df = read_sales_csv(file_path)
         
         # Standardize column names (lowercase, strip spaces)
         df.columns = df.columns.str.strip().str.lower()
@@ -18,7 +122,13 @@ def load_data(file_path):
         # Parse Dates (DD/MM/YYYY)
         if 'fecha' in df.columns:
             df['fecha'] = pd.to_datetime(df['fecha'], format='%d/%m/%Y', errors='coerce')
-            df['month_year'] = df['fecha'].dt.to_period('M')
+            # First day of each month as a plain datetime (numpy month floor, no Period objects)
+            df['month_year'] = df['fecha'].to_numpy().astype('datetime64[M]').astype(df['fecha'].dtype)
+            # Date parts computed once here so the views only group on them (no per-rerun copies)
+            df['year_month'] = date_part_column(df['fecha'].dt.year * 100 + df['fecha'].dt.month, 'int32')
+            df['num_mes'] = date_part_column(df['fecha'].dt.month, 'int8')
+            df['num_anio'] = date_part_column(df['fecha'].dt.year, 'int16')
+            df['nombre_mes'] = df['fecha'].dt.month_name().astype('category')
         
         # Ensure numeric columns are numeric
         numeric_cols = ['venta_neta', 'cantidad', 'precio_unitario', 'total_linea', 'importetotal']
@@ -26,16 +136,227 @@ def load_data(file_path):
             if col in df.columns:
                 df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
         
+        # Integer columns to the smallest int dtype that holds them (lossless)
+        for col in df.select_dtypes(include='integer').columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        
         # Normalize Product Names
         if 'producto' in df.columns:
             df = normalize_products(df)
-            
+        
+        # Repeated string keys as categoricals: groupby/nunique work on integer codes
+        for col in CATEGORICAL_COLS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        
+        if 'categoria' in df.columns:
+            df['categoria_base'] = base_categories(df['categoria'])
+        
+        if PYARROW_AVAILABLE:
+            write_parquet_cache(df, file_path, source_version)
         return df
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return pd.DataFrame()
 
 
+def date_part_column(values, dtype):
+    """Narrow int date part; nullable (Int8...) only when unparseable dates left NaT rows."""
+    return values.astype(dtype.capitalize() if values.isna().any() else dtype)
+
+
+NS_PER_DAY = 86_400_000_000_000
+
+
+def days_since(today, dates):
+    """
+    Whole days from each date to `today` (same as `(today - dates).dt.days`, without Timedelta boxing).
+    int32: day counts fit, and the arrays plotly serializes are half the size.
+    """
+    ns = np.asarray(dates, dtype='datetime64[ns]').view('i8')
+    return ((pd.Timestamp(today).value - ns) // NS_PER_DAY).astype(np.int32)
+
+
+def days_between(start, end):
+    """Whole days from each `start` to the matching `end` as int32 (same as `(end - start).dt.days`)."""
+    start_ns = np.asarray(start, dtype='datetime64[ns]').view('i8')
+    end_ns = np.asarray(end, dtype='datetime64[ns]').view('i8')
+    return ((end_ns - start_ns) // NS_PER_DAY).astype(np.int32)
+
+
+# pd.read_csv's default na_values, so Arrow turns the same cells (blank included) into nulls
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                 '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+def read_sales_csv(file_path):
+    """
+    Parse the raw CSV with Arrow's multi-threaded reader when available, with the same
+    values as pd.read_csv: blank/NA cells are missing and dates are left as text for load_data.
+    """
+    if not PYARROW_AVAILABLE:
+        return pd.read_csv(file_path, encoding='utf-8-sig')
+    
+    options = pa_csv.ConvertOptions(strings_can_be_null=True, null_values=CSV_NA_VALUES)
+    # Arrow infers ISO dates/times (createdAt...) on its own; pd.read_csv keeps them as text
+    reader = pa_csv.open_csv(file_path, convert_options=options)
+    options.column_types = {f.name: pa.string() for f in reader.schema if pa.types.is_temporal(f.type)}
+    reader.close()
+    
+    table = pa_csv.read_csv(file_path, convert_options=options)
+    # All-empty columns come back as Arrow null type; pandas reads those as float NaN
+    table = table.cast(pa.schema([
+        pa.field(f.name, pa.float64()) if pa.types.is_null(f.type) else f
+        for f in table.schema
+    ]))
+    # Release each Arrow column as it is converted, so the file is not held twice in memory
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def contains_mask(values, pattern):
+    """
+    Row mask of values.str.lower() containing `pattern` as a literal substring (regex=False, so
+    search text like "(" or "+" can't break the match). On a Categorical the match runs once per
+    category and rows are mapped through their codes.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.str.lower().str.contains(pattern, na=False, regex=False).to_numpy(dtype=bool)
+    hit = np.asarray(values.cat.categories.str.lower().str.contains(pattern, na=False, regex=False), dtype=bool)
+    codes = values.cat.codes.to_numpy()
+    return (codes >= 0) & hit[codes]
+
+
+def top_k(values, k, ascending=False, mask=None):
+    """
+    Positions of the k largest values (smallest if ascending), best first.
+    O(N) partition instead of a full sort; ties keep row order like nlargest(keep='first').
+    """
+    values = np.asarray(values)
+    idx = np.arange(len(values)) if mask is None else np.flatnonzero(mask)
+    keys = values[idx] if ascending else -values[idx]
+    if 0 < k < len(idx):
+        # Keep everything up to the k-th key (boundary ties included), then sort only that
+        kth = keys[np.argpartition(keys, k - 1)[k - 1]]
+        sel = keys <= kth
+        idx, keys = idx[sel], keys[sel]
+    return idx[np.argsort(keys, kind='stable')[:k]]
+
+
+def monthly_sums_by_key(df, key, month_col, months):
+    """
+    venta_neta per categorical `key` for each month number in `months`, as a keys x months frame
+    (NaN where a key had no rows that month, keys with no rows dropped) - same as
+    groupby([key, month_col], observed=True).sum().unstack(), in one bincount pass over the codes.
+    """
+    codes = df[key].cat.codes.to_numpy()
+    slot_of = np.full(13, -1)
+    slot_of[list(months)] = np.arange(len(months))
+    slots = slot_of[df[month_col].to_numpy(dtype='int64', na_value=0)]
+    valid = (codes >= 0) & (slots >= 0)
+    
+    categories = df[key].cat.categories
+    size = len(categories) * len(months)
+    flat = codes[valid].astype(np.int64) * len(months) + slots[valid]
+    sums = np.bincount(flat, weights=df['venta_neta'].to_numpy()[valid], minlength=size).reshape(-1, len(months))
+    counts = np.bincount(flat, minlength=size).reshape(-1, len(months))
+    sums[counts == 0] = np.nan
+    
+    observed = counts.any(axis=1)
+    return pd.DataFrame(sums[observed], index=categories[observed], columns=list(months))
+
+
+def rfm_segment_rules(r, f, m):
+    """
+    Masks of the RFM segment rules for 1-5 score arrays, in priority order
+    (VIP, Leal, Potencial, En Riesgo, Dormidos, Perdidos, Nuevos; anything else is Regular).
+    Feed them to np.select so the first matching rule wins, as in an if/elif chain.
+    """
+    r, f, m = np.asarray(r), np.asarray(f), np.asarray(m)
+    return [
+        (r >= 4) & (f >= 4) & (m >= 4),
+        (r >= 4) & (f >= 4),
+        (r >= 4) & (m >= 4),
+        (r <= 2) & (f >= 3) & (m >= 3),
+        (r <= 2) & (m >= 3),
+        r <= 2,
+        (r >= 4) & (f <= 2),
+    ]
+
+
+def rank_quintiles(values):
+    """
+    1-5 quintile of each value by position in a stable sort, as int8. Same bins as
+    pd.qcut(series.rank(method='first'), 5, labels=[1, 2, 3, 4, 5]), from one argsort:
+    qcut's edges over ranks 0..n-1 are k*(n-1)/5, so a rank falls in bin ceil(5*rank/(n-1)).
+    """
+    values = np.asarray(values)
+    n = len(values)
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[np.argsort(values, kind='stable')] = np.arange(n)
+    if n < 2:
+        return np.ones(n, dtype=np.int8)
+    return np.maximum(1, (5 * ranks + n - 2) // (n - 1)).astype(np.int8)
+
+
+def shift_month(month, offset):
+    """Month number `offset` months before `month`, wrapping around the year (1..12)."""
+    return (month - offset - 1) % 12 + 1
+
+
+def months_before(day, months):
+    """
+    `day` (datetime64[D]) minus `months` calendar months, like pd.DateOffset(months=...):
+    keeps the day of month, clipped to the last day of the target month.
+    """
+    month = day.astype('datetime64[M]')
+    target = month - np.timedelta64(months, 'M')
+    target_len = (target + 1).astype('datetime64[D]') - target.astype('datetime64[D]')
+    return target.astype('datetime64[D]') + min(day - month.astype('datetime64[D]'), target_len - 1)
+
+
+def format_year_month(year_month):
+    """'YYYY-MM' labels for a Series of year*100+month ints (run after aggregating)."""
+    return year_month.map(lambda ym: f"{ym // 100}-{ym % 100:02d}")
+
+
+_NUMERIC_SUFFIX_RE = re.compile(r'[\s-]*[\d]+$')
+_TRAILING_SEP_RE = re.compile(r'[\s-]+$')
+
+
+def get_base_category(cat):
+    """Extract base category name by removing numeric suffix."""
+    if not isinstance(cat, str):
+        return 'OTROS'
+    # Remove numbers and dashes at the end, keep the base name
+    # Examples: TELA AUTO-1000 -> TELA AUTO, PVC BONDE -3116 -> PVC BONDE
+    base = _NUMERIC_SUFFIX_RE.sub('', cat).strip()
+    base = _TRAILING_SEP_RE.sub('', base).strip()
+    return base if base else cat
+
+
+def base_categories(categoria):
+    """
+    Categorical of get_base_category for a categorical `categoria` column.
+    The regex runs once per category and rows are remapped through their codes;
+    missing or blank ('', '  ') categories become 'OTROS', as get_base_category does.
+    """
+    categories = categoria.cat.categories
+    bases = categories.map(get_base_category)
+    blank = np.asarray(categories.astype(str).str.strip() == '', dtype=bool)
+    codes = categoria.cat.codes.to_numpy()
+    # Code -1 (NaN) picks the appended slot, also when there are no categories at all
+    missing = np.append(blank, True)[codes]
+    base_index = pd.Index(bases[~blank].unique())
+    if missing.any():
+        base_index = base_index.append(pd.Index(['OTROS']))
+    base_index = base_index.unique().sort_values()
+    code_map = base_index.get_indexer(bases)
+    new_codes = np.append(code_map, -1)[codes]
+    if missing.any():
+        new_codes[missing] = base_index.get_loc('OTROS')
+    return pd.Categorical.from_codes(new_codes, categories=base_index)
+
+
 def clean_str(s):
     """Clean string for matching (lowercase, remove symbols, remove colors)."""
     if not isinstance(s, str): return ""
@@ -139,3 +460,23 @@ def get_kpis(df):
         "total_items": total_items,
         "avg_order_value": avg_order_value
     }
+
+
+def category_summary(sub):
+    """Totals, original categories and top-20 products of a slice of rows (one category or base group)."""
+    prods = sub.groupby('producto', observed=True, sort=False).agg({
+        'venta_neta': 'sum',
+        'cantidad': 'sum',
+        'cliente_nombre': 'nunique',
+        'fecha': 'max'
+    }).reset_index()
+    prods.columns = ['Producto', 'Ventas', 'Cantidad', 'Clientes', 'Última Venta']
+    return {
+        'ventas': sub['venta_neta'].sum(),
+        'cantidad': sub['cantidad'].sum(),
+        'clientes': sub['cliente_nombre'].nunique(),
+        'productos': sub['producto'].nunique(),
+        # Rows with no categoria land in the OTROS base group; they have no original name to list
+        'categorias': sorted(sub['categoria'].dropna().unique()),
+        'top_productos': prods.nlargest(20, 'Ventas')  # only the top 20 are shown
+    }
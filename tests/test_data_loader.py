@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from data_loader import base_categories, category_summary, load_data, read_sales_csv
+
+SALES_CSV = (
+    "fecha,factura_id,producto,cliente_nombre,categoria,vendedor,cantidad,venta_neta,createdAt\n"
+    "31/02/2025,1,VINIL 13 4,ACME,,,2,10.5,2026-01-09T22:56:36.436Z\n"
+    "01/03/2025,2,VINIL 13 4,,TELA AUTO-1000,Juan,NA,20,2026-01-09\n"
+    "15/03/2025,3,PVC BONDE,ACME,  ,,1,,2026-01-10T08:00:00.000Z\n"
+)
+
+
+def write_csv(tmp_path, text=SALES_CSV):
+    path = tmp_path / "ventas.csv"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_read_sales_csv_matches_pandas(tmp_path):
+    path = write_csv(tmp_path)
+    df = read_sales_csv(path)
+    pd.testing.assert_frame_equal(df, pd.read_csv(path, encoding="utf-8-sig"))
+    # Blank cells are missing, not '', and dates stay text for load_data to parse
+    assert df["categoria"].isna().sum() == 1
+    assert df["cliente_nombre"].isna().sum() == 1
+    assert df.loc[0, "fecha"] == "31/02/2025"
+
+
+def test_load_data_impossible_date_is_missing(tmp_path):
+    df = load_data(write_csv(tmp_path))
+    assert pd.isna(df.loc[0, "fecha"])
+    assert df.loc[1, "fecha"] == pd.Timestamp("2025-03-01")
+
+
+def test_base_categories_blank_is_otros(tmp_path):
+    categoria = read_sales_csv(write_csv(tmp_path))["categoria"].astype("category")
+    bases = base_categories(categoria)
+    # Row 0 is empty, row 2 only spaces: both fall into OTROS, no '' group
+    assert list(bases) == ["OTROS", "TELA AUTO", "OTROS"]
+    assert list(bases.categories) == ["OTROS", "TELA AUTO"]
+
+
+def test_category_summary_of_otros_with_missing_categoria(tmp_path):
+    df = load_data(write_csv(tmp_path))
+    # Same slice the app's category_detail takes for the OTROS base group
+    rows = df.groupby("categoria_base", observed=True, sort=False).indices["OTROS"]
+    summary = category_summary(df.take(rows))
+    assert summary["categorias"] == ["  "]
+    assert summary["ventas"] == 10.5
+
+
+def test_parquet_sidecar_ignored_for_swapped_csv_with_old_mtime(tmp_path):
+    path = write_csv(tmp_path)
+    assert len(load_data(path)) == 3
+    # Replace the CSV with fewer rows but keep (copy -p style) the original mtime
+    stat = os.stat(path)
+    write_csv(tmp_path, SALES_CSV.rsplit("\n", 2)[0] + "\n")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert len(load_data(path)) == 2